@@ -1,20 +1,113 @@
+import asyncio
+import io
 import logging
-from typing import Set
+from datetime import datetime, timezone
+from typing import Optional, Set
 from telegram import Update
 from telegram.ext import ContextTypes
 from utils import get_user_identifier
+from broadcast import BroadcastManager
+from stats import StatsRecorder
+from media_cache import FileIdCache
+from callback_registry import CallbackRegistry
+from launch_cache import LaunchCache
+from transcripts import TranscriptRecorder, create_sink
+from profiling import SamplingProfiler, SlowTurnRecorder
+from metrics import stats_summary
+from storage import create_store
+from config import (
+    BROADCAST_RATE, BROADCAST_CONCURRENCY,
+    STORAGE_BACKEND, STORAGE_PATH, STATS_FLUSH_INTERVAL, STATS_MAX_PENDING,
+    FILE_ID_CACHE_SIZE, FILE_ID_CACHE_TTL, FILE_ID_CACHE_PERSIST,
+    CALLBACK_REGISTRY_SIZE, CALLBACK_REGISTRY_PER_USER, CALLBACK_REGISTRY_TTL, CALLBACK_REGISTRY_PERSIST,
+    LAUNCH_CACHE_TTL, ADMIN_CACHE_TTL,
+    TRANSCRIPTS_ENABLED, TRANSCRIPT_BACKEND, TRANSCRIPT_PATH, TRANSCRIPT_QUEUE_SIZE, TRANSCRIPT_BATCH_SIZE,
+    TRANSCRIPT_FLUSH_INTERVAL, TRANSCRIPT_OVERFLOW, TRANSCRIPT_MAX_FILE_MB, TRANSCRIPT_BACKUPS,
+    TRANSCRIPT_RETENTION_DAYS, SLOW_TURN_THRESHOLD_MS, SLOW_TURN_CAPACITY
+)
 
 logger = logging.getLogger(__name__)
 
-# Store admin user IDs
+# Persistent storage for admins, statistics and background job state
+STORE = create_store(STORAGE_BACKEND, STORAGE_PATH)
+# Admin user IDs, re-read from the store every ADMIN_CACHE_TTL seconds by a background
+# task so that admins added (and launch cache clears) in another worker are picked up
 ADMIN_IDS: Set[str] = set()
-# Store active user statistics
-USER_STATS = {
-    'total_users': set(),
-    'total_messages': 0
-}
+_refresh_task: Optional[asyncio.Task] = None
+# Write-behind user statistics
+USER_STATS = StatsRecorder(STORE, STATS_FLUSH_INTERVAL, STATS_MAX_PENDING)
+# Background broadcast runner
+BROADCASTS = BroadcastManager(STORE, BROADCAST_RATE, BROADCAST_CONCURRENCY)
+# Image URL -> Telegram file_id cache
+FILE_IDS = FileIdCache(FILE_ID_CACHE_SIZE, FILE_ID_CACHE_TTL, STORE if FILE_ID_CACHE_PERSIST else None)
+# Choice button token -> original Voiceflow request
+CALLBACKS = CallbackRegistry(
+    CALLBACK_REGISTRY_SIZE, CALLBACK_REGISTRY_PER_USER, CALLBACK_REGISTRY_TTL,
+    STORE if CALLBACK_REGISTRY_PERSIST else None
+)
+# Voiceflow version -> launch traces shown on /start
+LAUNCH_CACHE = LaunchCache(LAUNCH_CACHE_TTL, STORE)
+# Background writer for conversation transcripts, if enabled
+TRANSCRIPTS = TranscriptRecorder(
+    create_sink(
+        TRANSCRIPT_BACKEND, TRANSCRIPT_PATH, int(TRANSCRIPT_MAX_FILE_MB * 1024 * 1024),
+        TRANSCRIPT_BACKUPS, TRANSCRIPT_RETENTION_DAYS
+    ),
+    TRANSCRIPT_QUEUE_SIZE, TRANSCRIPT_BATCH_SIZE, TRANSCRIPT_FLUSH_INTERVAL, TRANSCRIPT_OVERFLOW
+) if TRANSCRIPTS_ENABLED else None
+
+# Largest number of transcript records in one export
+MAX_EXPORT_RECORDS = 50000
+# On-demand profiler of the event loop and ring buffer of slow turns
+PROFILER = SamplingProfiler()
+SLOW_TURNS = SlowTurnRecorder(SLOW_TURN_THRESHOLD_MS / 1000, SLOW_TURN_CAPACITY)
+MAX_PROFILE_SECONDS = 120
 
 class AdminHandler:
+    @staticmethod
+    def _load_admins():
+        admins = STORE.get_admins()
+        ADMIN_IDS.clear()
+        ADMIN_IDS.update(admins)
+
+    @staticmethod
+    async def _refresh_loop():
+        """Pick up shared state written by other worker processes, off the request path"""
+        while True:
+            await asyncio.sleep(ADMIN_CACHE_TTL)
+            try:
+                await asyncio.to_thread(AdminHandler._load_admins)
+                await LAUNCH_CACHE.sync()
+            except Exception as e:
+                logger.error(f"Failed to refresh shared state: {str(e)}")
+
+    @staticmethod
+    async def startup(bot):
+        """Load persisted state and start background tasks"""
+        global _refresh_task
+        await asyncio.to_thread(AdminHandler._load_admins)
+        await LAUNCH_CACHE.sync()
+        _refresh_task = asyncio.create_task(AdminHandler._refresh_loop())
+        await USER_STATS.start()
+        if TRANSCRIPTS:
+            await TRANSCRIPTS.start()
+        await FILE_IDS.load()
+        await BROADCASTS.resume(bot)
+
+    @staticmethod
+    async def shutdown():
+        """Stop background tasks and flush pending statistics"""
+        if _refresh_task:
+            _refresh_task.cancel()
+            await asyncio.gather(_refresh_task, return_exceptions=True)
+        await BROADCASTS.stop()
+        await USER_STATS.stop()
+        if TRANSCRIPTS:
+            await TRANSCRIPTS.stop()
+        await FILE_IDS.save()
+        await CALLBACKS.save()
+        STORE.close()
+
     @staticmethod
     def is_admin(user_id: str) -> bool:
         """Check if user is an admin"""
@@ -28,8 +121,10 @@ class AdminHandler:
             return
             
         # First user to use this command becomes admin
+        await asyncio.to_thread(AdminHandler._load_admins)
         if not ADMIN_IDS:
             ADMIN_IDS.add(user_id)
+            await asyncio.to_thread(STORE.add_admin, user_id)
             await update.message.reply_text("You are now the first admin!")
             return
             
@@ -45,6 +140,7 @@ class AdminHandler:
             
         new_admin_id = context.args[0]
         ADMIN_IDS.add(new_admin_id)
+        await asyncio.to_thread(STORE.add_admin, new_admin_id)
         await update.message.reply_text(f"User {new_admin_id} has been added as admin.")
 
     @staticmethod
@@ -55,10 +151,23 @@ class AdminHandler:
             await update.message.reply_text("You don't have permission to use this command.")
             return
             
+        stats = await USER_STATS.snapshot()
+        hourly = ", ".join(
+            f"{datetime.fromtimestamp(hour * 3600, timezone.utc):%H}h: {count}"
+            for hour, count in stats['hourly_messages']
+        )
         stats_message = (
             f"📊 Bot Statistics:\n"
-            f"Total Users: {len(USER_STATS['total_users'])}\n"
-            f"Total Messages: {USER_STATS['total_messages']}"
+            f"Total Users: {stats['total_users']}\n"
+            f"Total Messages: {stats['total_messages']}\n"
+            f"Daily Active Users: ~{stats['daily_active_users']}\n"
+            f"Weekly Active Users: ~{stats['weekly_active_users']}\n"
+            f"Messages (last hour / 24h): {stats['messages_last_hour']} / {stats['messages_last_24h']}\n"
+            f"Messages per hour (UTC): {hourly}\n"
+            f"Image cache: {FILE_IDS.hits} hits / {FILE_IDS.misses} misses ({len(FILE_IDS)} cached)\n"
+            f"Launch cache: {LAUNCH_CACHE.hits} hits / {LAUNCH_CACHE.misses} misses\n"
+            f"Slow turns captured: {SLOW_TURNS.captured} ({len(SLOW_TURNS)} kept)\n\n"
+            f"{stats_summary()}"
         )
         await update.message.reply_text(stats_message)
 
@@ -74,21 +183,133 @@ class AdminHandler:
             await update.message.reply_text("Please provide a message to broadcast.")
             return
             
+        if BROADCASTS.running or await BROADCASTS.running_elsewhere():
+            await update.message.reply_text("A broadcast is already running. Check it with /broadcast_status")
+            return
+
         broadcast_message = " ".join(context.args)
-        success_count = 0
-        
-        for user_id in USER_STATS['total_users']:
-            try:
-                await context.bot.send_message(
-                    chat_id=user_id,
-                    text=f"📢 Broadcast: {broadcast_message}"
-                )
-                success_count += 1
-            except Exception as e:
-                logger.error(f"Failed to send broadcast to user {user_id}: {str(e)}")
-                
+        job = await BROADCASTS.start(context.bot, broadcast_message)
         await update.message.reply_text(
-            f"Broadcast sent successfully to {success_count}/{len(USER_STATS['total_users'])} users."
+            f"Broadcast {job.job_id} started for {job.total} users. Check progress with /broadcast_status"
+        )
+
+    @staticmethod
+    async def broadcast_status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Show progress of the current broadcast"""
+        user_id = get_user_identifier(update)
+        if not user_id or not AdminHandler.is_admin(user_id):
+            await update.message.reply_text("You don't have permission to use this command.")
+            return
+
+        await BROADCASTS.refresh()
+        await update.message.reply_text(BROADCASTS.status_text())
+
+    @staticmethod
+    async def clear_launch_cache_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Drop cached /start greetings, e.g. after publishing a new Voiceflow version"""
+        user_id = get_user_identifier(update)
+        if not user_id or not AdminHandler.is_admin(user_id):
+            await update.message.reply_text("You don't have permission to use this command.")
+            return
+
+        version = context.args[0] if context.args else None
+        dropped = await LAUNCH_CACHE.clear(version)
+        await update.message.reply_text(f"Launch cache cleared ({dropped} cached greeting(s) dropped).")
+
+    @staticmethod
+    async def export_transcripts_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Send conversation transcripts of one user or everyone as a gzipped JSONL file"""
+        user_id = get_user_identifier(update)
+        if not user_id or not AdminHandler.is_admin(user_id):
+            await update.message.reply_text("You don't have permission to use this command.")
+            return
+
+        if TRANSCRIPTS is None:
+            await update.message.reply_text("Transcripts are not enabled.")
+            return
+
+        args = context.args or []
+        target = args[0] if args else 'all'
+        try:
+            hours = float(args[1]) if len(args) > 1 else 24.0
+        except ValueError:
+            await update.message.reply_text("Usage: /export_transcripts [user_id|all] [hours]")
+            return
+
+        until = datetime.now(timezone.utc).timestamp()
+        since = until - hours * 3600
+        data = await TRANSCRIPTS.export(None if target == 'all' else target, since, until, MAX_EXPORT_RECORDS)
+        filename = f"transcripts-{target}-{datetime.fromtimestamp(until, timezone.utc):%Y%m%d-%H%M}.jsonl.gz"
+        await update.message.reply_document(
+            document=io.BytesIO(data),
+            filename=filename,
+            caption=f"Transcripts for {target}, last {hours:g} hours"
+        )
+
+    @staticmethod
+    async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Profile the event loop for N seconds and send the collapsed stacks"""
+        user_id = get_user_identifier(update)
+        if not user_id or not AdminHandler.is_admin(user_id):
+            await update.message.reply_text("You don't have permission to use this command.")
+            return
+
+        try:
+            seconds = float(context.args[0]) if context.args else 10.0
+        except ValueError:
+            await update.message.reply_text("Usage: /profile [seconds]")
+            return
+        seconds = min(max(seconds, 1.0), MAX_PROFILE_SECONDS)
+        if PROFILER.running:
+            await update.message.reply_text("A profile is already running.")
+            return
+
+        await update.message.reply_text(f"Profiling for {seconds:g} seconds...")
+        report = await PROFILER.profile(seconds)
+        await update.message.reply_document(
+            document=io.BytesIO(report.encode('utf-8')),
+            filename=f"profile-{datetime.now(timezone.utc):%Y%m%d-%H%M%S}.folded",
+            caption="Collapsed stacks, e.g. for flamegraph.pl or speedscope.app"
+        )
+
+    @staticmethod
+    async def slow_turns_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Set the slow-turn threshold, or download the captured turns"""
+        user_id = get_user_identifier(update)
+        if not user_id or not AdminHandler.is_admin(user_id):
+            await update.message.reply_text("You don't have permission to use this command.")
+            return
+
+        if context.args:
+            arg = context.args[0].lower()
+            if arg == 'off':
+                SLOW_TURNS.threshold = 0
+                await update.message.reply_text("Slow-turn capture disabled.")
+            elif arg == 'clear':
+                SLOW_TURNS.clear()
+                await update.message.reply_text("Captured slow turns cleared.")
+            else:
+                try:
+                    threshold_ms = float(arg)
+                except ValueError:
+                    threshold_ms = 0.0
+                if not 0 < threshold_ms < float('inf'):
+                    await update.message.reply_text(
+                        "Usage: /slow_turns [threshold_ms|off|clear]; the threshold must be a positive number."
+                    )
+                    return
+                SLOW_TURNS.threshold = threshold_ms / 1000
+                await update.message.reply_text(f"Capturing turns slower than {threshold_ms:g} ms.")
+            return
+
+        if not len(SLOW_TURNS):
+            state = f"threshold {SLOW_TURNS.threshold * 1000:g} ms" if SLOW_TURNS.threshold else "capture is off"
+            await update.message.reply_text(f"No slow turns captured ({state}).")
+            return
+        await update.message.reply_document(
+            document=io.BytesIO(SLOW_TURNS.dump()),
+            filename=f"slow-turns-{datetime.now(timezone.utc):%Y%m%d-%H%M%S}.jsonl",
+            caption=f"{len(SLOW_TURNS)} slow turns (threshold {SLOW_TURNS.threshold * 1000:g} ms)"
         )
 
     @staticmethod
@@ -104,6 +325,11 @@ class AdminHandler:
             "/add_admin <user_id> - Add a new admin\n"
             "/stats - Show bot statistics\n"
             "/broadcast <message> - Send message to all users\n"
+            "/broadcast_status - Show broadcast progress\n"
+            "/clear_launch_cache [version] - Drop cached /start greetings\n"
+            "/export_transcripts [user_id|all] [hours] - Download conversation transcripts\n"
+            "/profile [seconds] - Profile the bot and download a flamegraph report\n"
+            "/slow_turns [threshold_ms|off|clear] - Capture or download slow turns\n"
             "/help_admin - Show this help message"
         )
         await update.message.reply_text(help_text)
@@ -111,5 +337,4 @@ class AdminHandler:
     @staticmethod
     def update_stats(user_id: str):
         """Update user statistics"""
-        USER_STATS['total_users'].add(user_id)
-        USER_STATS['total_messages'] += 1
+        USER_STATS.record(user_id)
@@ -0,0 +1,103 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Tuple
+from metrics import ADMISSION_WAIT, ADMISSION_REJECTED
+
+logger = logging.getLogger(__name__)
+
+# Lower values are admitted first
+PRIORITY_ADMIN = 0
+PRIORITY_CALLBACK = 1
+PRIORITY_TEXT = 2
+
+class OverloadedError(Exception):
+    """Raised when a request is shed because the bot is at capacity"""
+
+class AdmissionController:
+    """
+    Caps the number of upstream requests in flight. Requests beyond the cap wait in a
+    bounded priority queue; when the queue is full the lowest priority request is shed,
+    and a request that waits longer than ``queue_timeout`` is rejected.
+    """
+
+    def __init__(self, max_in_flight: int, max_queue: int, queue_timeout: float):
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be a positive integer")
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def _reject(self, priority: int, reason: str) -> OverloadedError:
+        ADMISSION_REJECTED.inc(reason=reason, priority=priority)
+        return OverloadedError(f"Request rejected ({reason}): {self.in_flight} in flight, {self.queued} queued")
+
+    def _remove(self, entry: Tuple[int, int, asyncio.Future]):
+        self._waiters.remove(entry)
+        heapq.heapify(self._waiters)
+
+    async def acquire(self, priority: int = PRIORITY_TEXT):
+        """Wait for a free slot; raises OverloadedError if the request is shed"""
+        if self.in_flight < self.max_in_flight and not self._waiters:
+            self.in_flight += 1
+            ADMISSION_WAIT.observe(0.0)
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            # Make room by shedding the newest request of the lowest priority, if it ranks below this one
+            worst = max(self._waiters, default=None)
+            if worst is None or worst[0] <= priority:
+                raise self._reject(priority, 'queue_full')
+            self._remove(worst)
+            worst[2].set_exception(self._reject(worst[0], 'preempted'))
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._sequence), future)
+        heapq.heappush(self._waiters, entry)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if future.done():
+                # The slot was handed over just as the deadline expired
+                future.result()
+            else:
+                self._remove(entry)
+                future.cancel()
+                raise self._reject(priority, 'deadline') from None
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self.release()
+            elif not future.done():
+                self._remove(entry)
+                future.cancel()
+            raise
+        ADMISSION_WAIT.observe(time.perf_counter() - started)
+
+    def release(self):
+        """Hand the slot to the highest priority waiter, or free it"""
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_TEXT) -> AsyncIterator[None]:
+        """Hold an admission slot for the duration of the block"""
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
@@ -0,0 +1,166 @@
+"""Local stand-ins for the Voiceflow runtime and the Telegram Bot API used by the load test"""
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import Counter
+from typing import Any, Dict, List
+from urllib.parse import parse_qs
+from http_server import HttpRequest, HttpResponse, HttpServer
+
+logger = logging.getLogger(__name__)
+
+TRACE_PROFILES = {
+    'text': [
+        {'type': 'text', 'payload': {'message': 'Thanks for your message!'}}
+    ],
+    'mixed': [
+        {'type': 'text', 'payload': {'message': 'Here is what I found.'}},
+        {'type': 'speak', 'payload': {'message': 'Anything else?'}},
+        {'type': 'visual', 'payload': {'image': 'https://example.com/bench/product.png'}},
+        {'type': 'choice', 'payload': {'buttons': [
+            {'name': 'Yes', 'request': {'type': 'path-yes', 'payload': {'label': 'Yes'}}},
+            {'name': 'No', 'request': {'type': 'path-no', 'payload': {'label': 'No'}}}
+        ]}}
+    ],
+    'rich': [
+        {'type': 'text', 'payload': {'message': 'Welcome back!'}},
+        {'type': 'visual', 'payload': {'image': 'https://example.com/bench/a.png'}},
+        {'type': 'visual', 'payload': {'image': 'https://example.com/bench/b.png'}},
+        {'type': 'text', 'payload': {'message': 'Pick a topic:'}},
+        {'type': 'choice', 'payload': {'buttons': [
+            {'name': 'Orders', 'request': {'type': 'intent', 'payload': {'intent': {'name': 'orders'}}}},
+            {'name': 'Billing', 'request': {'type': 'intent', 'payload': {'intent': {'name': 'billing'}}}},
+            {'name': 'Other', 'request': {'type': 'path-other', 'payload': {'label': 'Other'}}}
+        ]}}
+    ]
+}
+
+def _json(data: Any, status: int = 200) -> HttpResponse:
+    return HttpResponse(status, json.dumps(data).encode(), content_type='application/json')
+
+class FakeVoiceflow:
+    """Serves /state/user/{id}/interact and DELETE /state/user/{id} with configurable behaviour"""
+
+    def __init__(self, latency: float, jitter: float, profiles: Dict[str, float], error_rate: float):
+        self.latency = latency
+        self.jitter = jitter
+        self.profiles = list(profiles)
+        self.weights = list(profiles.values())
+        self.error_rate = error_rate
+        self.requests = Counter()
+
+    def register(self, server: HttpServer):
+        server.add_prefix_route('POST', '/state/user/', self.interact)
+        server.add_prefix_route('DELETE', '/state/user/', self.delete_state)
+        server.add_route('GET', '/_summary', self.summary)
+
+    async def _delay(self):
+        await asyncio.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+
+    async def interact(self, request: HttpRequest) -> HttpResponse:
+        self.requests['interact'] += 1
+        await self._delay()
+        if random.random() < self.error_rate:
+            self.requests['errors'] += 1
+            return _json({'message': 'injected failure'}, status=500)
+        profile = random.choices(self.profiles, self.weights)[0]
+        return _json(TRACE_PROFILES[profile])
+
+    async def delete_state(self, request: HttpRequest) -> HttpResponse:
+        self.requests['delete'] += 1
+        await self._delay()
+        return _json({})
+
+    async def summary(self, request: HttpRequest) -> HttpResponse:
+        return _json(dict(self.requests))
+
+class FakeTelegram:
+    """Minimal Bot API that answers like Telegram and records every outgoing call"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = Counter()
+        self.chat_calls: Dict[str, Counter] = {}
+        self.last_markup: Dict[str, Any] = {}
+        self._message_id = 0
+
+    def register(self, server: HttpServer):
+        server.add_prefix_route('POST', '/bot', self.bot_method)
+        server.add_route('GET', '/_summary', self.summary)
+        server.add_route('GET', '/_markup', self.markup)
+
+    def _message(self, chat_id: Any, **fields) -> Dict[str, Any]:
+        self._message_id += 1
+        message = {
+            'message_id': self._message_id,
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id), 'type': 'private'},
+            'from': {'id': 1, 'is_bot': True, 'first_name': 'Bench'}
+        }
+        message.update(fields)
+        return message
+
+    @staticmethod
+    def _photo(url: str) -> List[Dict[str, Any]]:
+        file_id = f"file-{abs(hash(url)) % 10 ** 8}"
+        return [{'file_id': file_id, 'file_unique_id': file_id, 'width': 100, 'height': 100}]
+
+    async def bot_method(self, request: HttpRequest) -> HttpResponse:
+        method = request.path.rsplit('/', 1)[-1]
+        self.calls[method] += 1
+        if request.headers.get('content-type', '').startswith('application/json'):
+            params = json.loads(request.body or b'{}')
+        else:
+            params = {k: v[0] for k, v in parse_qs(request.body.decode()).items()}
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        chat_id = params.get('chat_id', 0)
+        self.chat_calls.setdefault(str(chat_id), Counter())[method] += 1
+        if method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        elif method in ('sendMessage', 'editMessageText'):
+            if 'reply_markup' in params:
+                self.last_markup[str(chat_id)] = json.loads(params['reply_markup'])
+            result = self._message(chat_id, text=params.get('text', ''))
+        elif method == 'sendPhoto':
+            result = self._message(chat_id, photo=self._photo(params.get('photo', '')))
+        elif method == 'sendMediaGroup':
+            media = json.loads(params.get('media', '[]'))
+            result = [self._message(chat_id, photo=self._photo(item.get('media', ''))) for item in media]
+        else:
+            result = True
+        return _json({'ok': True, 'result': result})
+
+    async def summary(self, request: HttpRequest) -> HttpResponse:
+        """Calls per method, either in total or only those sent to ?chat_id="""
+        chat_id = parse_qs(request.query).get('chat_id', [None])[0]
+        if chat_id is None:
+            return _json(dict(self.calls))
+        return _json(dict(self.chat_calls.get(chat_id, {})))
+
+    async def markup(self, request: HttpRequest) -> HttpResponse:
+        chat_id = parse_qs(request.query).get('chat_id', [''])[0]
+        return _json(self.last_markup.pop(chat_id, None))
+
+def serve(voiceflow_port: int, telegram_port: int, options: Dict[str, Any]):
+    """Entry point of the stand-in process; runs both fake services until killed"""
+    logging.basicConfig(level=logging.WARNING)
+
+    async def run():
+        voiceflow = FakeVoiceflow(
+            options['voiceflow_latency'], options['voiceflow_jitter'],
+            options['profiles'], options['error_rate']
+        )
+        telegram = FakeTelegram(options['telegram_latency'])
+        voiceflow_server = HttpServer('127.0.0.1', voiceflow_port)
+        telegram_server = HttpServer('127.0.0.1', telegram_port)
+        voiceflow.register(voiceflow_server)
+        telegram.register(telegram_server)
+        await voiceflow_server.start()
+        await telegram_server.start()
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
@@ -0,0 +1,285 @@
+"""
+Load test for the bot: drives the real Application with synthetic users against local
+Voiceflow and Telegram stand-ins and writes a machine-readable report.
+
+    python -m benchmarks.load_test --users 200 --turns 10 --output results.json
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import fakes  # noqa: E402
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def _rss_mb() -> float:
+    """Resident set size of this process in MiB"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(percent / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+class LoadTest:
+    """Closed-loop load generator: every synthetic user waits for its turn to finish before the next one"""
+
+    def __init__(self, args: argparse.Namespace, telegram_url: str):
+        self.args = args
+        self.telegram_url = telegram_url
+        self.latencies: List[float] = []
+        self.timeouts = 0
+        self._update_id = 0
+        self._pending: Dict[int, asyncio.Future] = {}
+        self.application = None
+        self._http = None
+
+    async def _on_update_done(self, update, context):
+        future = self._pending.pop(update.update_id, None)
+        if future is not None and not future.done():
+            future.set_result(time.perf_counter())
+
+    def _next_update_id(self) -> int:
+        self._update_id += 1
+        return self._update_id
+
+    @staticmethod
+    def _user(user_id: int) -> Dict[str, Any]:
+        return {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'}
+
+    def _message_update(self, user_id: int, text: str) -> Dict[str, Any]:
+        update_id = self._next_update_id()
+        message = {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self._user(user_id),
+            'text': text
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return {'update_id': update_id, 'message': message}
+
+    def _callback_update(self, user_id: int, data: str) -> Dict[str, Any]:
+        update_id = self._next_update_id()
+        return {
+            'update_id': update_id,
+            'callback_query': {
+                'id': str(update_id),
+                'from': self._user(user_id),
+                'chat_instance': str(user_id),
+                'data': data,
+                'message': {
+                    'message_id': update_id,
+                    'date': int(time.time()),
+                    'chat': {'id': user_id, 'type': 'private'},
+                    'from': {'id': 1, 'is_bot': True, 'first_name': 'Bench'},
+                    'text': 'Pick one'
+                }
+            }
+        }
+
+    async def _turn(self, data: Dict[str, Any], record: bool = True):
+        from telegram import Update
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending[data['update_id']] = future
+        started = time.perf_counter()
+        await self.application.update_queue.put(Update.de_json(data, self.application.bot))
+        try:
+            finished = await asyncio.wait_for(future, timeout=self.args.turn_timeout)
+        except asyncio.TimeoutError:
+            self._pending.pop(data['update_id'], None)
+            self.timeouts += 1
+            return
+        if record:
+            self.latencies.append(finished - started)
+
+    async def _last_markup(self, user_id: int) -> Optional[Dict[str, Any]]:
+        response = await self._http.get(f"{self.telegram_url}/_markup", params={'chat_id': user_id})
+        return response.json()
+
+    async def _run_user(self, user_id: int):
+        await asyncio.sleep(random.random() * self.args.ramp_up)
+        await self._turn(self._message_update(user_id, '/start'))
+        for turn in range(self.args.turns):
+            markup = await self._last_markup(user_id)
+            if markup and random.random() < self.args.click_ratio:
+                buttons = [button for row in markup['inline_keyboard'] for button in row]
+                data = self._callback_update(user_id, random.choice(buttons)['callback_data'])
+            else:
+                data = self._message_update(user_id, f"synthetic message {turn}")
+            await self._turn(data)
+            if self.args.think_time:
+                await asyncio.sleep(random.expovariate(1 / self.args.think_time))
+
+    async def _run_admin(self, admin_id: int, stop: asyncio.Event):
+        await self._turn(self._message_update(admin_id, '/add_admin'), record=False)
+        while not stop.is_set():
+            await self._turn(self._message_update(admin_id, '/stats'), record=False)
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=self.args.stats_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self) -> Dict[str, Any]:
+        import httpx
+        from telegram.ext import TypeHandler
+        from telegram import Update
+        import bot
+
+        self.application = bot.build_application(base_url=f"{self.telegram_url}/bot")
+        # Runs after the real handlers (group 0) and marks the update as fully processed
+        self.application.add_handler(TypeHandler(Update, self._on_update_done), group=99)
+        self._http = httpx.AsyncClient()
+
+        rss_start = _rss_mb()
+        await self.application.initialize()
+        await self.application.post_init(self.application)
+        await self.application.start()
+
+        stop = asyncio.Event()
+        admin_id = 10 ** 9
+        admin_task = asyncio.create_task(self._run_admin(admin_id, stop))
+        started = time.perf_counter()
+        await asyncio.gather(*(self._run_user(user_id) for user_id in range(1, self.args.users + 1)))
+        duration = time.perf_counter() - started
+        stop.set()
+        await admin_task
+        rss_end = _rss_mb()
+
+        telegram_calls = (await self._http.get(f"{self.telegram_url}/_summary")).json()
+        admin_calls = (await self._http.get(f"{self.telegram_url}/_summary", params={'chat_id': admin_id})).json()
+        voiceflow_calls = (await self._http.get(f"{self.args.voiceflow_url}/_summary")).json()
+        await self._http.aclose()
+        await self.application.stop()
+        await self.application.shutdown()
+        await self.application.post_shutdown(self.application)
+
+        turns = len(self.latencies)
+        # The admin's /add_admin and /stats replies are not part of any measured turn
+        user_calls = sum(count for method, count in telegram_calls.items() if method != 'getMe')
+        user_calls -= sum(admin_calls.values())
+        return {
+            'turns': turns,
+            'timeouts': self.timeouts,
+            'duration_s': round(duration, 3),
+            'throughput_turns_per_s': round(turns / duration, 2) if duration else 0,
+            'latency_ms': {
+                'mean': round(statistics.mean(self.latencies) * 1000, 2) if turns else 0,
+                'p50': round(_percentile(self.latencies, 50) * 1000, 2),
+                'p95': round(_percentile(self.latencies, 95) * 1000, 2),
+                'p99': round(_percentile(self.latencies, 99) * 1000, 2),
+                'max': round(max(self.latencies, default=0) * 1000, 2)
+            },
+            'telegram_calls_per_turn': round(user_calls / turns, 3) if turns else 0,
+            'telegram_calls': telegram_calls,
+            'admin_telegram_calls': admin_calls,
+            'voiceflow_requests': voiceflow_calls,
+            'rss_mb': {'start': round(rss_start, 1), 'end': round(rss_end, 1),
+                       'growth': round(rss_end - rss_start, 1)}
+        }
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100, help='Number of concurrent synthetic users')
+    parser.add_argument('--turns', type=int, default=5, help='Turns per user after /start')
+    parser.add_argument('--ramp-up', type=float, default=1.0, help='Seconds over which users start')
+    parser.add_argument('--think-time', type=float, default=0.0, help='Mean pause between turns of one user')
+    parser.add_argument('--click-ratio', type=float, default=0.5, help='Chance to click a button when offered')
+    parser.add_argument('--stats-interval', type=float, default=2.0, help='Seconds between admin /stats calls')
+    parser.add_argument('--turn-timeout', type=float, default=60.0)
+    parser.add_argument('--voiceflow-latency', type=float, default=0.15, help='Mean Voiceflow latency (s)')
+    parser.add_argument('--voiceflow-jitter', type=float, default=0.05)
+    parser.add_argument('--telegram-latency', type=float, default=0.02, help='Latency per Telegram call (s)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of Voiceflow calls that fail')
+    parser.add_argument('--profile', action='append', default=None, metavar='NAME=WEIGHT',
+                        help=f"Trace mix, e.g. --profile text=3 --profile rich=1 ({', '.join(fakes.TRACE_PROFILES)})")
+    parser.add_argument('--output', default=None, help='Where to write the JSON report')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    profiles = {}
+    for item in args.profile or ['text=2', 'mixed=1', 'rich=1']:
+        name, _, weight = item.partition('=')
+        if name not in fakes.TRACE_PROFILES:
+            raise SystemExit(f"Unknown profile: {name}")
+        profiles[name] = float(weight or 1)
+
+    voiceflow_port, telegram_port = _free_port(), _free_port()
+    args.voiceflow_url = f"http://127.0.0.1:{voiceflow_port}"
+    telegram_url = f"http://127.0.0.1:{telegram_port}"
+    options = {
+        'voiceflow_latency': args.voiceflow_latency,
+        'voiceflow_jitter': args.voiceflow_jitter,
+        'telegram_latency': args.telegram_latency,
+        'error_rate': args.error_rate,
+        'profiles': profiles
+    }
+    stand_ins = multiprocessing.get_context('spawn').Process(
+        target=fakes.serve, args=(voiceflow_port, telegram_port, options), daemon=True
+    )
+    stand_ins.start()
+    time.sleep(1.0)
+
+    # The bot reads its configuration at import time, so point it at the stand-ins first
+    os.environ.update({
+        'TELEGRAM_TOKEN': os.environ.get('BENCH_TELEGRAM_TOKEN', '123456:bench'),
+        'VOICEFLOW_API_KEY': 'bench',
+        'VOICEFLOW_BASE_URL': args.voiceflow_url,
+        'BOT_MODE': 'polling',
+        'STORAGE_BACKEND': os.environ.get('STORAGE_BACKEND', 'memory'),
+        'LOG_LEVEL': os.environ.get('LOG_LEVEL', 'WARNING')
+    })
+    try:
+        results = asyncio.run(LoadTest(args, telegram_url).run())
+    finally:
+        stand_ins.terminate()
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'git_revision': _git_revision(),
+        'parameters': {key: value for key, value in vars(args).items() if key != 'voiceflow_url'},
+        'results': results
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+if __name__ == '__main__':
+    main()
@@ -1,46 +1,109 @@
+import asyncio
 import logging
+from typing import Optional
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler as TelegramMessageHandler, CallbackQueryHandler
 from telegram.ext import filters
-from config import TELEGRAM_TOKEN
+from config import (
+    TELEGRAM_TOKEN, CONCURRENT_UPDATES, USER_QUEUE_SIZE, BOT_MODE,
+    METRICS_PORT, METRICS_LISTEN, TELEGRAM_POOL_SIZE, WORKER_PROCESSES
+)
 from handlers import MessageHandler
-from admin_handlers import AdminHandler
+from admin_handlers import AdminHandler, SLOW_TURNS
+from update_processor import PerUserUpdateProcessor
+from webhook import run_webhook
+from sharding import run_sharded
+from metrics import InstrumentedRequest, create_metrics_server
 
 logger = logging.getLogger(__name__)
 
+def build_application(base_url: Optional[str] = None, updater: bool = True,
+                      shard: Optional[int] = None) -> Application:
+    """
+    Create the application with all handlers registered. Worker processes pass
+    updater=False because updates reach them from the front process, and their
+    shard number so each one serves metrics on its own port.
+    """
+    # Initialize handlers
+    message_handler = MessageHandler()
+    admin_handler = AdminHandler()
+    metrics_port = METRICS_PORT + (shard or 0) if METRICS_PORT else 0
+    metrics_server = create_metrics_server(METRICS_LISTEN, metrics_port) if metrics_port else None
+
+    async def post_init(application: Application):
+        """Load persisted state and resume background work"""
+        await AdminHandler.startup(application.bot)
+        if metrics_server:
+            await metrics_server.start()
+
+    async def post_shutdown(application: Application):
+        """Release shared resources once the application stops"""
+        if metrics_server:
+            await metrics_server.stop()
+        await AdminHandler.shutdown()
+        await message_handler.voiceflow_client.close()
+
+    # Create application
+    builder = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .request(InstrumentedRequest(connection_pool_size=TELEGRAM_POOL_SIZE))
+        .concurrent_updates(PerUserUpdateProcessor(
+            CONCURRENT_UPDATES, USER_QUEUE_SIZE,
+            on_enqueue=message_handler.coalescer.on_enqueue if message_handler.coalescer else None,
+            before_process=message_handler.coalescer.wait if message_handler.coalescer else None,
+            on_finish=SLOW_TURNS.on_finish
+        ))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if base_url:
+        builder = builder.base_url(base_url)
+    if not updater:
+        builder = builder.updater(None)
+    application = builder.build()
+
+    # Add regular handlers
+    application.add_handler(CommandHandler("start", message_handler.start_command))
+    application.add_handler(CommandHandler("help", message_handler.help_command))
+    application.add_handler(CommandHandler("clear", message_handler.clear_command))
+
+    # Add admin handlers
+    application.add_handler(CommandHandler("add_admin", admin_handler.add_admin_command))
+    application.add_handler(CommandHandler("stats", admin_handler.stats_command))
+    application.add_handler(CommandHandler("broadcast", admin_handler.broadcast_command))
+    application.add_handler(CommandHandler("broadcast_status", admin_handler.broadcast_status_command))
+    application.add_handler(CommandHandler("clear_launch_cache", admin_handler.clear_launch_cache_command))
+    application.add_handler(CommandHandler("export_transcripts", admin_handler.export_transcripts_command))
+    application.add_handler(CommandHandler("profile", admin_handler.profile_command))
+    application.add_handler(CommandHandler("slow_turns", admin_handler.slow_turns_command))
+    application.add_handler(CommandHandler("help_admin", admin_handler.help_admin_command))
+
+    # Add callback query handler for buttons
+    application.add_handler(CallbackQueryHandler(message_handler.button_callback))
+
+    # Add message handler (should be last)
+    application.add_handler(TelegramMessageHandler(
+        filters.TEXT & ~filters.COMMAND,
+        message_handler.message_handler
+    ))
+    return application
+
 def main():
     """Initialize and start the bot"""
     try:
-        # Create application
-        application = Application.builder().token(TELEGRAM_TOKEN).build()
-        
-        # Initialize handlers
-        message_handler = MessageHandler()
-        admin_handler = AdminHandler()
-        
-        # Add regular handlers
-        application.add_handler(CommandHandler("start", message_handler.start_command))
-        application.add_handler(CommandHandler("help", message_handler.help_command))
-        application.add_handler(CommandHandler("clear", message_handler.clear_command))
-        
-        # Add admin handlers
-        application.add_handler(CommandHandler("add_admin", admin_handler.add_admin_command))
-        application.add_handler(CommandHandler("stats", admin_handler.stats_command))
-        application.add_handler(CommandHandler("broadcast", admin_handler.broadcast_command))
-        application.add_handler(CommandHandler("help_admin", admin_handler.help_admin_command))
-        
-        # Add callback query handler for buttons
-        application.add_handler(CallbackQueryHandler(message_handler.button_callback))
-        
-        # Add message handler (should be last)
-        application.add_handler(TelegramMessageHandler(
-            filters.TEXT & ~filters.COMMAND,
-            message_handler.message_handler
-        ))
-        
+        if WORKER_PROCESSES > 0:
+            run_sharded()
+            return
+
+        application = build_application()
+
         # Start the bot
-        logger.info("Starting bot...")
-        application.run_polling(allowed_updates=Update.ALL_TYPES)
+        logger.info(f"Starting bot in {BOT_MODE} mode...")
+        if BOT_MODE == 'webhook':
+            asyncio.run(run_webhook(application))
+        else:
+            application.run_polling(allowed_updates=Update.ALL_TYPES)
         
     except Exception as e:
         logger.error(f"Error starting bot: {str(e)}")
@@ -0,0 +1,257 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from datetime import timedelta
+from typing import Any, Dict, Optional
+from telegram import Bot
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+from storage import StatsStore
+
+logger = logging.getLogger(__name__)
+
+def _retry_seconds(error: RetryAfter) -> float:
+    """Return the RetryAfter delay in seconds regardless of how the library reports it"""
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+class TokenBucket:
+    """Async token bucket that also honours Telegram's RetryAfter pauses"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """Stop handing out tokens for the given number of seconds"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        """Wait until a token is available and take it"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class BroadcastJob:
+    """Progress of a single broadcast"""
+
+    def __init__(self, message: str, total: int, job_id: Optional[str] = None):
+        self.job_id = job_id or uuid.uuid4().hex[:8]
+        self.message = message
+        self.total = total
+        self.cursor = 0
+        self.last_user_id: Optional[str] = None
+        self.sent = 0
+        self.failed = 0
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        # Worker shard running the job (None in single-process mode) and its last progress save
+        self.owner: Optional[int] = None
+        self.updated_at = self.started_at
+
+    @property
+    def done(self) -> bool:
+        return self.finished_at is not None
+
+    def eta_seconds(self) -> Optional[float]:
+        """Estimate the remaining run time from the average send rate so far"""
+        elapsed = time.time() - self.started_at
+        if self.cursor == 0 or elapsed <= 0:
+            return None
+        return (self.total - self.cursor) / (self.cursor / elapsed)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'job_id': self.job_id,
+            'message': self.message,
+            'total': self.total,
+            'cursor': self.cursor,
+            'last_user_id': self.last_user_id,
+            'sent': self.sent,
+            'failed': self.failed,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'owner': self.owner,
+            'updated_at': self.updated_at
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'BroadcastJob':
+        job = cls(data['message'], data['total'], data['job_id'])
+        job.cursor = data['cursor']
+        job.last_user_id = data.get('last_user_id')
+        job.sent = data['sent']
+        job.failed = data['failed']
+        job.started_at = data['started_at']
+        job.finished_at = data.get('finished_at')
+        job.owner = data.get('owner')
+        job.updated_at = data.get('updated_at', job.started_at)
+        return job
+
+class BroadcastManager:
+    """Run broadcasts in the background with rate limiting and resumable progress"""
+
+    STATE_NAMESPACE = 'broadcast'
+    # A job whose progress was saved this recently is considered alive in another process
+    HEARTBEAT_TIMEOUT = 60.0
+
+    def __init__(self, store: StatsStore, rate: float, concurrency: int, max_retries: int = 3):
+        self.store = store
+        self.bucket = TokenBucket(rate)
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.job: Optional[BroadcastJob] = None
+        self._task: Optional[asyncio.Task] = None
+        self._last_save = 0.0
+        # Set in worker processes; each job is resumed only by the shard that ran it
+        self.shard: Optional[int] = None
+        self.shard_count = 1
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self, bot: Bot, message: str) -> BroadcastJob:
+        """Start a new broadcast to every known user in the background"""
+        if self.running:
+            raise RuntimeError("A broadcast is already running")
+        total = await asyncio.to_thread(self.store.total_users)
+        self.job = BroadcastJob(message, total)
+        self.job.owner = self.shard
+        await asyncio.to_thread(self._save_state)
+        self._task = asyncio.create_task(self._run(bot))
+        return self.job
+
+    async def resume(self, bot: Bot):
+        """Resume an unfinished broadcast left over from a previous run"""
+        job = await asyncio.to_thread(self._load)
+        if job is None or job.done:
+            return
+        self.job = job
+        if not self._owns(job):
+            return
+        logger.info(f"Resuming broadcast {job.job_id} at {job.cursor}/{job.total}")
+        self._task = asyncio.create_task(self._run(bot))
+
+    def _owns(self, job: BroadcastJob) -> bool:
+        """Whether this process should resume the job; orphaned jobs go to the first shard"""
+        if job.owner is None or job.owner >= self.shard_count:
+            return self.shard in (None, 0)
+        return job.owner == self.shard
+
+    def _alive(self, job: BroadcastJob) -> bool:
+        return not job.done and time.time() - job.updated_at < self.HEARTBEAT_TIMEOUT
+
+    async def running_elsewhere(self) -> bool:
+        """Check whether another worker process is running a broadcast"""
+        job = await asyncio.to_thread(self._load)
+        return job is not None and self._alive(job)
+
+    async def refresh(self):
+        """Pick up the progress of a broadcast run by another worker process"""
+        if self.running:
+            return
+        job = await asyncio.to_thread(self._load)
+        if job is not None:
+            self.job = job
+
+    async def stop(self):
+        """Stop the running broadcast, keeping its progress for the next start"""
+        if self.running:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self.job:
+            self._save_state()
+
+    def status_text(self) -> str:
+        """Describe the current or last broadcast for admins"""
+        job = self.job
+        if job is None:
+            return "No broadcast has been started."
+        percent = (job.cursor / job.total * 100) if job.total else 100
+        lines = [
+            f"📢 Broadcast {job.job_id}: "
+            f"{'finished' if job.done else 'running' if self.running or self._alive(job) else 'paused'}",
+            f"Progress: {job.cursor}/{job.total} ({percent:.1f}%)",
+            f"Delivered: {job.sent}, Failed: {job.failed}"
+        ]
+        eta = job.eta_seconds()
+        if not job.done and eta is not None:
+            lines.append(f"ETA: {timedelta(seconds=int(eta))}")
+        return "\n".join(lines)
+
+    async def _run(self, bot: Bot):
+        job = self.job
+        text = f"📢 Broadcast: {job.message}"
+        try:
+            while True:
+                # Users are paged by ID so progress is a single resumable cursor
+                chunk = await asyncio.to_thread(self.store.get_users_after, job.last_user_id, self.concurrency)
+                if not chunk:
+                    break
+                results = await asyncio.gather(*(self._send(bot, chat_id, text) for chat_id in chunk))
+                job.sent += sum(results)
+                job.failed += len(results) - sum(results)
+                job.cursor += len(chunk)
+                job.last_user_id = chunk[-1]
+                job.total = max(job.total, job.cursor)
+                if time.monotonic() - self._last_save >= 1:
+                    await asyncio.to_thread(self._save_state)
+            job.finished_at = time.time()
+            await asyncio.to_thread(self._save_state)
+            logger.info(f"Broadcast {job.job_id} finished: {job.sent}/{job.total} delivered")
+        except Exception as e:
+            logger.error(f"Broadcast {job.job_id} stopped unexpectedly: {str(e)}")
+            self._save_state()
+
+    async def _send(self, bot: Bot, chat_id: str, text: str) -> bool:
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            try:
+                await bot.send_message(chat_id=chat_id, text=text)
+                return True
+            except RetryAfter as e:
+                logger.warning(f"Flood limit hit during broadcast, pausing for {_retry_seconds(e)}s")
+                self.bucket.pause(_retry_seconds(e))
+            except (Forbidden, BadRequest) as e:
+                logger.info(f"Broadcast not delivered to user {chat_id}: {str(e)}")
+                return False
+            except TelegramError as e:
+                logger.warning(f"Broadcast to user {chat_id} failed (attempt {attempt + 1}): {str(e)}")
+                await asyncio.sleep(2 ** attempt)
+        logger.error(f"Failed to send broadcast to user {chat_id} after {self.max_retries + 1} attempts")
+        return False
+
+    def _save_state(self):
+        self._last_save = time.monotonic()
+        self.job.updated_at = time.time()
+        self.store.set_value(self.STATE_NAMESPACE, 'job', json.dumps(self.job.to_dict()))
+
+    def _load(self) -> Optional[BroadcastJob]:
+        data = self.store.get_value(self.STATE_NAMESPACE, 'job')
+        if data is None:
+            return None
+        try:
+            return BroadcastJob.from_dict(json.loads(data))
+        except (ValueError, KeyError) as e:
+            logger.error(f"Could not load broadcast state: {str(e)}")
+            return None
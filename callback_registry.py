@@ -0,0 +1,96 @@
+import asyncio
+import json
+import logging
+import secrets
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from storage import StatsStore
+
+logger = logging.getLogger(__name__)
+
+CALLBACK_PREFIX = 'vf:'
+
+class CallbackRegistry:
+    """
+    Server-side store for Voiceflow button requests. Each button gets a short opaque
+    token as its callback_data, and the original request is looked up when clicked.
+    """
+
+    SPILL_BATCH_SIZE = 200
+
+    def __init__(self, max_entries: int, max_per_user: int, ttl: float, store: Optional[StatsStore] = None):
+        self.max_entries = max_entries
+        self.max_per_user = max_per_user
+        self.ttl = ttl
+        self.store = store
+        # token -> (user_id, request, created_at), oldest first
+        self._entries: 'OrderedDict[str, Tuple[str, Dict[str, Any], float]]' = OrderedDict()
+        # user_id -> that user's tokens, oldest first
+        self._user_tokens: Dict[str, 'OrderedDict[str, None]'] = {}
+        self._spill: List[Tuple[str, str, float]] = []
+        self._spill_task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def callback_data(self, user_id: str, request: Dict[str, Any]) -> str:
+        """Register a button request and return the callback_data to put on the button"""
+        token = secrets.token_urlsafe(9)
+        self._entries[token] = (user_id, request, time.time())
+        user_tokens = self._user_tokens.setdefault(user_id, OrderedDict())
+        user_tokens[token] = None
+        while len(user_tokens) > self.max_per_user:
+            self._evict(user_tokens.popitem(last=False)[0])
+        while len(self._entries) > self.max_entries:
+            self._evict(next(iter(self._entries)))
+        return f"{CALLBACK_PREFIX}{token}"
+
+    async def resolve(self, callback_data: str) -> Optional[Dict[str, Any]]:
+        """Return the request registered for the callback_data, or None if it expired"""
+        token = callback_data[len(CALLBACK_PREFIX):]
+        entry = self._entries.get(token)
+        if entry is None and self.store is not None:
+            data = await asyncio.to_thread(self.store.get_callback, token)
+            if data is not None:
+                user_id, request, created_at = json.loads(data)
+                entry = (user_id, request, created_at)
+        if entry is None or time.time() - entry[2] >= self.ttl:
+            return None
+        return entry[1]
+
+    def _evict(self, token: str):
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        user_id = entry[0]
+        user_tokens = self._user_tokens.get(user_id)
+        if user_tokens is not None:
+            user_tokens.pop(token, None)
+            if not user_tokens:
+                del self._user_tokens[user_id]
+        if self.store is not None and time.time() - entry[2] < self.ttl:
+            self._spill.append((token, json.dumps(entry), entry[2]))
+            if len(self._spill) >= self.SPILL_BATCH_SIZE and (self._spill_task is None or self._spill_task.done()):
+                self._spill_task = asyncio.get_running_loop().create_task(self.flush())
+
+    async def flush(self):
+        """Write evicted entries to the persistent store and purge the expired ones"""
+        batch, self._spill = self._spill, []
+        if not batch or self.store is None:
+            return
+        try:
+            await asyncio.to_thread(self.store.put_callbacks, batch, time.time() - self.ttl)
+        except Exception as e:
+            logger.error(f"Failed to spill {len(batch)} callback entries: {str(e)}")
+
+    async def save(self):
+        """Spill every live entry so buttons keep working after a restart"""
+        if self.store is None:
+            return
+        now = time.time()
+        self._spill.extend(
+            (token, json.dumps(entry), entry[2]) for token, entry in self._entries.items()
+            if now - entry[2] < self.ttl
+        )
+        await self.flush()
@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Set, Tuple
+from telegram import Update
+from utils import validate_message, MAX_INPUT_LENGTH
+from metrics import MESSAGES_COALESCED
+
+logger = logging.getLogger(__name__)
+
+# Buffered text message: (update_id, text, arrival time). None marks a non-text update
+# that messages must not be merged across, such as a command or a button press.
+_Entry = Optional[Tuple[int, str, float]]
+
+class MessageCoalescer:
+    """
+    Merges text messages a user sends in quick succession into a single turn.
+
+    Updates are registered as they arrive with ``on_enqueue``. Once the oldest buffered
+    message is first in its user's lane, ``wait`` holds it until the user has been quiet
+    for ``window`` seconds (at most ``max_wait`` after that message arrived). This runs
+    before the update takes a worker slot, so waiting users do not occupy workers. The
+    handler then calls ``take``, which returns the buffered texts joined together;
+    handlers of the merged messages get None.
+    """
+
+    def __init__(self, window: float, max_wait: float, max_length: int = MAX_INPUT_LENGTH):
+        self.window = window
+        self.max_wait = max(window, max_wait)
+        self.max_length = max_length
+        self._buffers: Dict[str, Deque[_Entry]] = {}
+        self._consumed: Set[int] = set()
+
+    def on_enqueue(self, update: object):
+        """Register an update as soon as it is received, before it waits for its turn"""
+        if not isinstance(update, Update) or not update.effective_user:
+            return
+        user_id = str(update.effective_user.id)
+        message = update.message
+        text = message.text if message else None
+        if text and not text.startswith('/') and validate_message(text)[0]:
+            self._buffers.setdefault(user_id, deque()).append((update.update_id, text, time.monotonic()))
+        elif user_id in self._buffers:
+            self._buffers[user_id].append(None)
+
+    def _head(self, user_id: str, update_id: int) -> Optional[Deque[_Entry]]:
+        """The user's buffer if this update is the oldest message in it"""
+        buffer = self._buffers.get(user_id)
+        while buffer and buffer[0] is None:
+            buffer.popleft()
+        if not buffer or buffer[0][0] != update_id:
+            return None
+        return buffer
+
+    async def wait(self, update: object):
+        """Hold the oldest buffered message of a user until the user has stopped typing"""
+        if not isinstance(update, Update) or not update.effective_user or update.update_id in self._consumed:
+            return
+        user_id = str(update.effective_user.id)
+        buffer = self._head(user_id, update.update_id)
+        if buffer is None:
+            return
+
+        try:
+            deadline = buffer[0][2] + self.max_wait
+            while True:
+                last_arrival = buffer[0][2]
+                for entry in buffer:
+                    if entry is None:
+                        break
+                    last_arrival = entry[2]
+                delay = min(last_arrival + self.window, deadline) - time.monotonic()
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            if buffer and buffer[0] is not None and buffer[0][0] == update.update_id:
+                buffer.popleft()
+            raise
+
+    def take(self, user_id: str, update_id: int, text: str) -> Optional[str]:
+        """
+        Return the text to send for this update, or None if it was already merged into
+        an earlier turn
+        """
+        if update_id in self._consumed:
+            self._consumed.discard(update_id)
+            return None
+
+        buffer = self._head(user_id, update_id)
+        if buffer is None:
+            return text
+
+        parts = [buffer.popleft()[1]]
+        length = len(parts[0])
+        while buffer and buffer[0] is not None and length + 1 + len(buffer[0][1]) <= self.max_length:
+            merged_id, merged_text, _ = buffer.popleft()
+            self._consumed.add(merged_id)
+            parts.append(merged_text)
+            length += 1 + len(merged_text)
+        if not buffer:
+            del self._buffers[user_id]
+
+        if len(parts) > 1:
+            MESSAGES_COALESCED.inc(len(parts) - 1)
+            logger.info(f"Merged {len(parts)} messages from user {user_id} into one turn")
+        return "\n".join(parts)
@@ -8,8 +8,108 @@ load_dotenv()
 # Bot Configuration
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
 VOICEFLOW_API_KEY = os.getenv('VOICEFLOW_API_KEY')
-VOICEFLOW_BASE_URL = 'https://general-runtime.voiceflow.com'
+VOICEFLOW_BASE_URL = os.getenv('VOICEFLOW_BASE_URL', 'https://general-runtime.voiceflow.com')
 VOICEFLOW_VERSION = os.getenv('VOICEFLOW_VERSION_ID', 'production')  # Default to production version
+VOICEFLOW_PROJECT_ID = os.getenv('VOICEFLOW_PROJECT_ID')  # Needed for the streaming API
+
+# Streaming responses (Voiceflow streaming interact API)
+VOICEFLOW_STREAMING = os.getenv('VOICEFLOW_STREAMING', 'false').lower() == 'true'
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', '1.0'))  # Min seconds between message edits
+
+# Voiceflow HTTP connection pool
+VOICEFLOW_POOL_SIZE = int(os.getenv('VOICEFLOW_POOL_SIZE', '100'))
+VOICEFLOW_KEEPALIVE_CONNECTIONS = int(os.getenv('VOICEFLOW_KEEPALIVE_CONNECTIONS', '20'))
+VOICEFLOW_CONNECT_TIMEOUT = float(os.getenv('VOICEFLOW_CONNECT_TIMEOUT', '5'))
+VOICEFLOW_READ_TIMEOUT = float(os.getenv('VOICEFLOW_READ_TIMEOUT', '30'))
+VOICEFLOW_HTTP2 = os.getenv('VOICEFLOW_HTTP2', 'true').lower() == 'true'  # Used only if the h2 package is installed
+
+# Voiceflow version resolution and circuit breaker
+VERSION_CACHE_TTL = float(os.getenv('VERSION_CACHE_TTL', '300'))  # Seconds to remember a production fallback
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', '5'))  # Consecutive failures before opening
+BREAKER_RECOVERY_TIMEOUT = float(os.getenv('BREAKER_RECOVERY_TIMEOUT', '30'))  # Seconds before trial requests
+BREAKER_HALF_OPEN_CALLS = int(os.getenv('BREAKER_HALF_OPEN_CALLS', '1'))
+
+# Voiceflow deadlines, retries and hedging
+VOICEFLOW_ATTEMPT_TIMEOUT = float(os.getenv('VOICEFLOW_ATTEMPT_TIMEOUT', '10'))  # Seconds per HTTP attempt
+VOICEFLOW_TOTAL_TIMEOUT = float(os.getenv('VOICEFLOW_TOTAL_TIMEOUT', '25'))  # Seconds for a call including retries
+VOICEFLOW_RETRY_ATTEMPTS = int(os.getenv('VOICEFLOW_RETRY_ATTEMPTS', '3'))  # Attempts for retryable failures
+VOICEFLOW_RETRY_BASE_DELAY = float(os.getenv('VOICEFLOW_RETRY_BASE_DELAY', '0.2'))
+VOICEFLOW_RETRY_MAX_DELAY = float(os.getenv('VOICEFLOW_RETRY_MAX_DELAY', '2'))
+VOICEFLOW_HEDGE_LAUNCH = os.getenv('VOICEFLOW_HEDGE_LAUNCH', 'false').lower() == 'true'
+VOICEFLOW_HEDGE_MIN_SAMPLES = int(os.getenv('VOICEFLOW_HEDGE_MIN_SAMPLES', '50'))  # Launches observed before hedging
+VOICEFLOW_HEDGE_BUDGET = float(os.getenv('VOICEFLOW_HEDGE_BUDGET', '0.1'))  # Max share of launches that are hedged
+
+# Admission control for Voiceflow requests
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv('ADMISSION_MAX_IN_FLIGHT', '50'))  # Concurrent Voiceflow requests
+ADMISSION_QUEUE_SIZE = int(os.getenv('ADMISSION_QUEUE_SIZE', '200'))  # Waiting requests before shedding
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', '5'))  # Max seconds to wait for a slot
+
+# Update processing
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '64'))  # Global cap on updates processed at once
+USER_QUEUE_SIZE = int(os.getenv('USER_QUEUE_SIZE', '20'))  # Max queued updates per user before dropping
+MESSAGE_DEBOUNCE_MS = int(os.getenv('MESSAGE_DEBOUNCE_MS', '0'))  # Merge rapid texts per user, 0 disables it
+MESSAGE_DEBOUNCE_MAX_WAIT_MS = int(os.getenv('MESSAGE_DEBOUNCE_MAX_WAIT_MS', '2000'))  # Longest delay of a turn
+
+# Multi-process runtime: a front process routes updates to worker processes by user
+WORKER_PROCESSES = int(os.getenv('WORKER_PROCESSES', '0'))  # 0 runs everything in a single process
+WORKER_DRAIN_TIMEOUT = float(os.getenv('WORKER_DRAIN_TIMEOUT', '30'))  # Seconds to finish queued updates on stop
+ADMIN_CACHE_TTL = float(os.getenv('ADMIN_CACHE_TTL', '10'))  # Seconds between background re-reads of admins from storage
+
+# Broadcasts
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '25'))  # Messages per second, Telegram allows about 30
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '10'))
+
+# Persistent storage
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'sqlite')  # 'sqlite' or 'memory'
+STORAGE_PATH = os.getenv('STORAGE_PATH', 'bot.db')
+STATS_FLUSH_INTERVAL = float(os.getenv('STATS_FLUSH_INTERVAL', '5'))  # Seconds between write-behind flushes
+STATS_MAX_PENDING = int(os.getenv('STATS_MAX_PENDING', '10000'))  # Pending users that force an early flush
+
+# Telegram file_id cache for Voiceflow images
+FILE_ID_CACHE_SIZE = int(os.getenv('FILE_ID_CACHE_SIZE', '5000'))
+FILE_ID_CACHE_TTL = float(os.getenv('FILE_ID_CACHE_TTL', str(30 * 24 * 3600)))  # Seconds
+FILE_ID_CACHE_PERSIST = os.getenv('FILE_ID_CACHE_PERSIST', 'true').lower() == 'true'
+
+# Server-side registry for choice button requests
+CALLBACK_REGISTRY_SIZE = int(os.getenv('CALLBACK_REGISTRY_SIZE', '100000'))
+CALLBACK_REGISTRY_PER_USER = int(os.getenv('CALLBACK_REGISTRY_PER_USER', '50'))
+CALLBACK_REGISTRY_TTL = float(os.getenv('CALLBACK_REGISTRY_TTL', str(7 * 24 * 3600)))  # Seconds
+CALLBACK_REGISTRY_PERSIST = os.getenv('CALLBACK_REGISTRY_PERSIST', 'true').lower() == 'true'
+
+# Cached launch traces for /start (streaming is not used for /start while enabled)
+LAUNCH_CACHE_ENABLED = os.getenv('LAUNCH_CACHE_ENABLED', 'false').lower() == 'true'
+LAUNCH_CACHE_TTL = float(os.getenv('LAUNCH_CACHE_TTL', '600'))  # Seconds
+
+# Conversation transcripts
+TRANSCRIPTS_ENABLED = os.getenv('TRANSCRIPTS_ENABLED', 'false').lower() == 'true'
+TRANSCRIPT_BACKEND = os.getenv('TRANSCRIPT_BACKEND', 'jsonl')  # 'jsonl' (rotating gzip files) or 'sqlite'
+TRANSCRIPT_PATH = os.getenv(  # Directory for jsonl, database file for sqlite
+    'TRANSCRIPT_PATH', 'transcripts' if TRANSCRIPT_BACKEND == 'jsonl' else 'transcripts.db'
+)
+TRANSCRIPT_QUEUE_SIZE = int(os.getenv('TRANSCRIPT_QUEUE_SIZE', '10000'))
+TRANSCRIPT_BATCH_SIZE = int(os.getenv('TRANSCRIPT_BATCH_SIZE', '500'))
+TRANSCRIPT_FLUSH_INTERVAL = float(os.getenv('TRANSCRIPT_FLUSH_INTERVAL', '2'))  # Seconds between writes
+TRANSCRIPT_OVERFLOW = os.getenv('TRANSCRIPT_OVERFLOW', 'drop_oldest')  # 'drop_oldest', 'drop_newest' or 'block'
+TRANSCRIPT_MAX_FILE_MB = float(os.getenv('TRANSCRIPT_MAX_FILE_MB', '50'))  # Compressed size before rotating
+TRANSCRIPT_BACKUPS = int(os.getenv('TRANSCRIPT_BACKUPS', '20'))  # Rotated files to keep
+TRANSCRIPT_RETENTION_DAYS = float(os.getenv('TRANSCRIPT_RETENTION_DAYS', '30'))  # sqlite only, 0 keeps everything
+
+# Metrics
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))  # Prometheus /metrics endpoint, 0 disables it
+METRICS_LISTEN = os.getenv('METRICS_LISTEN', '0.0.0.0')
+TELEGRAM_POOL_SIZE = int(os.getenv('TELEGRAM_POOL_SIZE', '256'))  # Connections for Telegram API calls
+
+# Slow-turn capture (can also be changed at runtime with /slow_turns)
+SLOW_TURN_THRESHOLD_MS = float(os.getenv('SLOW_TURN_THRESHOLD_MS', '0'))  # 0 disables capturing
+SLOW_TURN_CAPACITY = int(os.getenv('SLOW_TURN_CAPACITY', '100'))  # Captured turns kept in memory
+
+# Serving mode: 'polling' or 'webhook'
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # Public base URL Telegram should call, e.g. https://bot.example.com
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
 
 # Configure logging
 LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
@@ -27,3 +127,19 @@ if not TELEGRAM_TOKEN:
 if not VOICEFLOW_API_KEY:
     logger.error("Voiceflow API key not found in environment variables")
     raise ValueError("VOICEFLOW_API_KEY environment variable is required")
+
+if VOICEFLOW_STREAMING and not VOICEFLOW_PROJECT_ID:
+    logger.error("Streaming is enabled but VOICEFLOW_PROJECT_ID is not set")
+    raise ValueError("VOICEFLOW_PROJECT_ID environment variable is required when VOICEFLOW_STREAMING is enabled")
+
+if BOT_MODE not in ('polling', 'webhook'):
+    logger.error(f"Unknown BOT_MODE: {BOT_MODE}")
+    raise ValueError("BOT_MODE must be 'polling' or 'webhook'")
+
+if BOT_MODE == 'webhook' and not (WEBHOOK_URL and WEBHOOK_SECRET):
+    logger.error("Webhook mode needs WEBHOOK_URL and WEBHOOK_SECRET")
+    raise ValueError("WEBHOOK_URL and WEBHOOK_SECRET environment variables are required in webhook mode")
+
+if WORKER_PROCESSES > 0 and STORAGE_BACKEND == 'memory':
+    logger.error("Worker processes cannot share the in-memory storage backend")
+    raise ValueError("STORAGE_BACKEND must be 'sqlite' when WORKER_PROCESSES is set")
@@ -1,10 +1,21 @@
+import asyncio
 import logging
-import requests
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import time
+import httpx
+from contextlib import aclosing
+from telegram import Update
 from telegram.ext import ContextTypes
 from voiceflow_client import VoiceflowClient
-from admin_handlers import AdminHandler
+from admin_handlers import AdminHandler, CALLBACKS, FILE_IDS, LAUNCH_CACHE, TRANSCRIPTS
 from utils import get_user_identifier, format_error_message, validate_message
+from rendering import plan_traces, send_step, StreamingRenderer
+from callback_registry import CALLBACK_PREFIX
+from admission import PRIORITY_ADMIN, PRIORITY_CALLBACK, PRIORITY_TEXT
+from coalescer import MessageCoalescer
+from config import (
+    VOICEFLOW_STREAMING, STREAM_EDIT_INTERVAL, MESSAGE_DEBOUNCE_MS, MESSAGE_DEBOUNCE_MAX_WAIT_MS, LAUNCH_CACHE_ENABLED
+)
+from metrics import RENDER_DURATION, timed
 
 logger = logging.getLogger(__name__)
 
@@ -12,6 +23,14 @@ class MessageHandler:
     def __init__(self):
         self.voiceflow_client = VoiceflowClient()
         self.admin_handler = AdminHandler()
+        self.coalescer = MessageCoalescer(
+            MESSAGE_DEBOUNCE_MS / 1000, MESSAGE_DEBOUNCE_MAX_WAIT_MS / 1000
+        ) if MESSAGE_DEBOUNCE_MS > 0 else None
+
+    @staticmethod
+    def _priority(user_id: str, default: int) -> int:
+        """Admission priority for a user's Voiceflow request; admins always go first"""
+        return PRIORITY_ADMIN if AdminHandler.is_admin(user_id) else default
 
     async def process_voiceflow_response(self, update: Update, traces: list, is_callback: bool = False):
         """Process and send Voiceflow response traces to the user"""
@@ -23,39 +42,64 @@ class MessageHandler:
                 await update.message.reply_text(message)
             return
 
-        for trace in traces:
-            try:
-                trace_type = trace.get('type')
-                if not trace_type:
-                    continue
-
-                # Get the appropriate message object based on context
-                msg_obj = update.callback_query.message if is_callback else update.message
-
-                if trace_type in ['text', 'speak']:
-                    message = trace.get('payload', {}).get('message')
-                    if message:
-                        await msg_obj.reply_text(message)
-                elif trace_type == 'visual':
-                    image_url = trace.get('payload', {}).get('image')
-                    if image_url:
-                        await msg_obj.reply_photo(image_url)
-                elif trace_type == 'choice':
-                    buttons = trace.get('payload', {}).get('buttons', [])
-                    if buttons:
-                        keyboard = []
-                        for button in buttons:
-                            callback_data = f"button_{button['request']['type']}_{button['name']}"
-                            keyboard.append([InlineKeyboardButton(button['name'], callback_data=callback_data)])
-                        reply_markup = InlineKeyboardMarkup(keyboard)
-                        await msg_obj.reply_text("Please choose an option:", reply_markup=reply_markup)
-                elif trace_type == 'end':
-                    await msg_obj.reply_text("Conversation ended. You can start a new one with /start")
-            except Exception as e:
-                logger.error(f"Error processing trace {trace_type}: {str(e)}")
-                user_msg, log_msg = format_error_message(e)
-                logger.error(log_msg)
-                await msg_obj.reply_text(user_msg)
+        # Get the appropriate message object based on context
+        msg_obj = update.callback_query.message if is_callback else update.message
+
+        # Plan the whole turn first so it costs as few Telegram requests as possible
+        user_id = get_user_identifier(update)
+        with timed('render', RENDER_DURATION):
+            steps = plan_traces(traces, lambda button: CALLBACKS.callback_data(user_id, button['request']))
+            for step in steps:
+                try:
+                    await send_step(msg_obj, step, FILE_IDS)
+                except Exception as e:
+                    logger.error(f"Error sending {step.kind} response: {str(e)}")
+                    user_msg, log_msg = format_error_message(e)
+                    logger.error(log_msg)
+                    await msg_obj.reply_text(user_msg)
+
+    async def record_turn(self, user_id: str, request: dict, traces: list, started: float, streamed: bool = False):
+        """Queue the turn for the transcript writer, if transcripts are enabled"""
+        if TRANSCRIPTS is not None:
+            await TRANSCRIPTS.record(
+                user_id, request, traces, time.perf_counter() - started,
+                self.voiceflow_client.active_version(), streamed
+            )
+
+    async def stream_voiceflow_response(self, update: Update, user_id: str, request: dict,
+                                        is_callback: bool = False, priority: int = PRIORITY_TEXT) -> bool:
+        """
+        Run a turn through the streaming API, rendering traces as they arrive.
+        Returns False if nothing was received, so the caller can fall back to the
+        regular request.
+        """
+        msg_obj = update.callback_query.message if is_callback else update.message
+        renderer = StreamingRenderer(
+            msg_obj,
+            lambda button: CALLBACKS.callback_data(user_id, button['request']),
+            FILE_IDS,
+            STREAM_EDIT_INTERVAL
+        )
+        received = []
+        started = time.perf_counter()
+        await renderer.start()
+        try:
+            async with aclosing(self.voiceflow_client.interact_stream(user_id, request, priority)) as traces:
+                async for trace in traces:
+                    received.append(trace)
+                    await renderer.add(trace)
+        except httpx.HTTPError as e:
+            if not received:
+                logger.warning(f"Streaming interaction failed, falling back to regular request: {str(e)}")
+                return False
+            raise
+        finally:
+            await renderer.finish()
+
+        await self.record_turn(user_id, request, received, started, streamed=True)
+        if not renderer.rendered_anything:
+            await msg_obj.reply_text("I didn't receive a response. Let's try starting over with /start")
+        return True
 
     async def button_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle button callback queries"""
@@ -63,32 +107,26 @@ class MessageHandler:
             query = update.callback_query
             await query.answer()  # Answer the callback query to remove the loading state
 
-            # Extract button info from callback data
-            _, button_type, button_label = query.data.split('_', 2)
             user_id = str(query.from_user.id)
 
-            # Create the appropriate request based on button type
-            if button_type == 'intent':
-                request = {
-                    'type': 'intent',
-                    'payload': {
-                        'intent': {
-                            'name': button_label.lower().replace(' ', '_')
-                        },
-                        'query': button_label,
-                        'entities': []
-                    }
-                }
-            else:  # Path ID or other types
-                request = {
-                    'type': button_type,
-                    'payload': {
-                        'label': button_label
-                    }
-                }
+            # Look up the original Voiceflow request stored for this button
+            if query.data.startswith(CALLBACK_PREFIX):
+                request = await CALLBACKS.resolve(query.data)
+                if request is None:
+                    await query.message.reply_text("This button has expired. Please use /start to continue.")
+                    return
+            else:
+                request = self._legacy_button_request(query.data)
+
+            priority = self._priority(user_id, PRIORITY_CALLBACK)
+            if VOICEFLOW_STREAMING and await self.stream_voiceflow_response(
+                    update, user_id, request, is_callback=True, priority=priority):
+                return
 
             # Send the request to Voiceflow
-            traces = await self.voiceflow_client.handle_button_click(user_id, request)
+            started = time.perf_counter()
+            traces = await self.voiceflow_client.handle_button_click(user_id, request, priority)
+            await self.record_turn(user_id, request, traces, started)
             
             # Process the response with is_callback=True
             await self.process_voiceflow_response(update, traces, is_callback=True)
@@ -98,6 +136,29 @@ class MessageHandler:
             logger.error(f"Error in button callback: {log_msg}")
             await query.message.reply_text(user_msg)
 
+    @staticmethod
+    def _legacy_button_request(callback_data: str) -> dict:
+        """Rebuild a request from buttons sent before callback tokens were introduced"""
+        _, button_type, button_label = callback_data.split('_', 2)
+        if button_type == 'intent':
+            return {
+                'type': 'intent',
+                'payload': {
+                    'intent': {
+                        'name': button_label.lower().replace(' ', '_')
+                    },
+                    'query': button_label,
+                    'entities': []
+                }
+            }
+        # Path ID or other types
+        return {
+            'type': button_type,
+            'payload': {
+                'label': button_label
+            }
+        }
+
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle the /start command"""
         try:
@@ -110,9 +171,18 @@ class MessageHandler:
             AdminHandler.update_stats(user_id)
             
             try:
-                traces = await self.voiceflow_client.launch_conversation(user_id)
+                priority = self._priority(user_id, PRIORITY_TEXT)
+                if LAUNCH_CACHE_ENABLED:
+                    await self.launch_with_cache(update, user_id, priority)
+                    return
+                if VOICEFLOW_STREAMING and await self.stream_voiceflow_response(
+                        update, user_id, {'type': 'launch'}, priority=priority):
+                    return
+                started = time.perf_counter()
+                traces = await self.voiceflow_client.launch_conversation(user_id, priority)
+                await self.record_turn(user_id, {'type': 'launch'}, traces, started)
                 await self.process_voiceflow_response(update, traces)
-            except requests.exceptions.RequestException as e:
+            except httpx.HTTPError as e:
                 user_msg, log_msg = format_error_message(e)
                 logger.error(log_msg)
                 await update.message.reply_text(user_msg)
@@ -122,6 +192,32 @@ class MessageHandler:
             logger.error(f"Error in start command: {log_msg}")
             await update.message.reply_text(user_msg)
 
+    async def launch_with_cache(self, update: Update, user_id: str, priority: int):
+        """
+        Launch the conversation, rendering the cached greeting right away if there is one.
+        The launch call still runs to initialise the user's Voiceflow state, and the turn
+        only ends once it has finished, so the user's next update sees that state.
+        """
+        version = self.voiceflow_client.active_version()
+        cached = LAUNCH_CACHE.get(version)
+        started = time.perf_counter()
+        launch = asyncio.ensure_future(self.voiceflow_client.launch_conversation(user_id, priority))
+        if cached is not None:
+            try:
+                await self.process_voiceflow_response(update, cached)
+            except BaseException:
+                launch.cancel()
+                raise
+
+        traces = await launch
+        await self.record_turn(user_id, {'type': 'launch'}, traces, started)
+        user = update.effective_user
+        identifiers = [user.username, user.first_name, user.last_name]
+        matches = LAUNCH_CACHE.offer(version, user_id, traces, identifiers)
+        if cached is None or not matches:
+            # Nothing was shown yet, or the cached greeting differs from this user's launch
+            await self.process_voiceflow_response(update, traces)
+
     async def clear_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle the /clear command to reset conversation history"""
         try:
@@ -130,7 +226,7 @@ class MessageHandler:
                 await update.message.reply_text("I couldn't identify you. Please try again later.")
                 return
 
-            success = await self.voiceflow_client.clear_state(user_id)
+            success = await self.voiceflow_client.clear_state(user_id, self._priority(user_id, PRIORITY_TEXT))
             if success:
                 await update.message.reply_text("Conversation history cleared. You can start a new conversation with /start")
             else:
@@ -159,10 +255,23 @@ class MessageHandler:
                 await update.message.reply_text(error_message)
                 return
 
+            if self.coalescer:
+                message = self.coalescer.take(user_id, update.update_id, message)
+                if message is None:
+                    # Already sent as part of an earlier merged turn
+                    return
+
             try:
-                traces = await self.voiceflow_client.send_message(user_id, message)
+                request = {'type': 'text', 'payload': message}
+                priority = self._priority(user_id, PRIORITY_TEXT)
+                if VOICEFLOW_STREAMING and await self.stream_voiceflow_response(
+                        update, user_id, request, priority=priority):
+                    return
+                started = time.perf_counter()
+                traces = await self.voiceflow_client.send_message(user_id, message, priority)
+                await self.record_turn(user_id, request, traces, started)
                 await self.process_voiceflow_response(update, traces)
-            except requests.exceptions.RequestException as e:
+            except httpx.HTTPError as e:
                 user_msg, log_msg = format_error_message(e)
                 logger.error(log_msg)
                 await update.message.reply_text(user_msg)
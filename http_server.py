@@ -0,0 +1,179 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_SIZE = 1024 * 1024
+# Seconds a client may take to send one request once it has started it
+REQUEST_TIMEOUT = 30.0
+# Seconds a connection may sit idle before (or between keep-alive) requests
+IDLE_TIMEOUT = 60.0
+# Connections served at once; further connections get 503 and are closed
+MAX_CONNECTIONS = 256
+_REASONS = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+            405: 'Method Not Allowed', 413: 'Payload Too Large', 500: 'Internal Server Error',
+            503: 'Service Unavailable'}
+
+class HttpRequest:
+    """A parsed HTTP request"""
+
+    def __init__(self, method: str, path: str, query: str, headers: Dict[str, str], body: bytes):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+
+class HttpResponse:
+    """A response to be written back to the client"""
+
+    def __init__(self, status: int = 200, body: bytes = b'', content_type: str = 'text/plain; charset=utf-8',
+                 headers: Optional[Dict[str, str]] = None):
+        self.status = status
+        self.body = body if isinstance(body, bytes) else body.encode()
+        self.content_type = content_type
+        self.headers = headers or {}
+
+Handler = Callable[[HttpRequest], Awaitable[HttpResponse]]
+
+class HttpServer:
+    """Minimal asyncio HTTP/1.1 server for the webhook and operational endpoints"""
+
+    def __init__(self, host: str, port: int, max_connections: int = MAX_CONNECTIONS,
+                 request_timeout: float = REQUEST_TIMEOUT, idle_timeout: float = IDLE_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.request_timeout = request_timeout
+        self.idle_timeout = idle_timeout
+        self._connections = asyncio.Semaphore(max_connections)
+        self._routes: Dict[Tuple[str, str], Handler] = {}
+        self._prefix_routes: Dict[Tuple[str, str], Handler] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def add_route(self, method: str, path: str, handler: Handler):
+        """Register a handler for the given method and exact path"""
+        self._routes[(method.upper(), path)] = handler
+
+    def add_prefix_route(self, method: str, prefix: str, handler: Handler):
+        """Register a handler for every path that starts with the given prefix"""
+        self._prefix_routes[(method.upper(), prefix)] = handler
+
+    async def start(self):
+        """Start listening for connections"""
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        logger.info(f"HTTP server listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        """Stop accepting connections and wait for the listener to close"""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        if self._connections.locked():
+            try:
+                await self._write_response(writer, HttpResponse(503, b'Service Unavailable'), keep_alive=False)
+            except ConnectionError:
+                pass
+            finally:
+                writer.close()
+            return
+        async with self._connections:
+            await self._serve_connection(reader, writer)
+
+    async def _serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                if isinstance(request, HttpResponse):
+                    async with asyncio.timeout(self.request_timeout):
+                        await self._write_response(writer, request, keep_alive=False)
+                    break
+                response = await self._dispatch(request)
+                keep_alive = request.headers.get('connection', '').lower() != 'close'
+                # A client that stops reading must not hold the connection either
+                async with asyncio.timeout(self.request_timeout):
+                    await self._write_response(writer, response, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except TimeoutError:
+            logger.debug("Closing HTTP connection that was idle or too slow")
+        except Exception as e:
+            logger.error(f"Error handling HTTP connection: {str(e)}")
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+        async with asyncio.timeout(self.idle_timeout):
+            request_line = await reader.readline()
+        if not request_line:
+            return None
+        async with asyncio.timeout(self.request_timeout):
+            return await self._read_rest(reader, request_line)
+
+    @staticmethod
+    async def _read_rest(reader: asyncio.StreamReader, request_line: bytes):
+        try:
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+        except ValueError:
+            return HttpResponse(400, b'Bad Request')
+
+        headers: Dict[str, str] = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get('content-length', '0'))
+        except ValueError:
+            return HttpResponse(400, b'Bad Request')
+        if length < 0:
+            return HttpResponse(400, b'Bad Request')
+        if length > MAX_BODY_SIZE:
+            return HttpResponse(413, b'Payload Too Large')
+        body = await reader.readexactly(length) if length else b''
+
+        path, _, query = target.partition('?')
+        return HttpRequest(method.upper(), path, query, headers, body)
+
+    async def _dispatch(self, request: HttpRequest) -> HttpResponse:
+        handler = self._routes.get((request.method, request.path))
+        if handler is None:
+            handler = self._match_prefix(request.method, request.path)
+        if handler is None:
+            if any(path == request.path for _, path in self._routes):
+                return HttpResponse(405, b'Method Not Allowed')
+            return HttpResponse(404, b'Not Found')
+        try:
+            return await handler(request)
+        except Exception as e:
+            logger.error(f"Error in HTTP handler for {request.path}: {str(e)}")
+            return HttpResponse(500, b'Internal Server Error')
+
+    def _match_prefix(self, method: str, path: str) -> Optional[Handler]:
+        matches = [(prefix, handler) for (route_method, prefix), handler in self._prefix_routes.items()
+                   if route_method == method and path.startswith(prefix)]
+        if not matches:
+            return None
+        return max(matches, key=lambda match: len(match[0]))[1]
+
+    @staticmethod
+    async def _write_response(writer: asyncio.StreamWriter, response: HttpResponse, keep_alive: bool):
+        head = [
+            f"HTTP/1.1 {response.status} {_REASONS.get(response.status, '')}",
+            f"Content-Type: {response.content_type}",
+            f"Content-Length: {len(response.body)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}"
+        ]
+        head.extend(f"{name}: {value}" for name, value in response.headers.items())
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode('latin-1') + response.body)
+        await writer.drain()
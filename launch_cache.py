@@ -0,0 +1,139 @@
+import asyncio
+import hashlib
+import json
+import logging
+import secrets
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+from storage import StatsStore
+
+logger = logging.getLogger(__name__)
+
+# Identifiers shorter than this are too likely to appear in a greeting by chance
+_MIN_IDENTIFIER_LENGTH = 3
+
+def _fingerprint(traces: List[dict]) -> str:
+    """Hash of the parts of the traces that are rendered, ignoring timestamps"""
+    content = [{'type': trace.get('type'), 'payload': trace.get('payload')} for trace in traces]
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+class LaunchCache:
+    """
+    Caches the launch traces of each Voiceflow version so /start can render the
+    greeting without waiting for Voiceflow.
+
+    Traces are only cached once two different users received identical traces that
+    mention neither of them, which keeps greetings with per-user variables out of the
+    cache. A version whose launches differ between users is not retried until the TTL
+    has passed.
+
+    With a store, ``clear`` also records a new generation there, and ``sync`` drops the
+    local entries of every process that sees the generation change.
+    """
+
+    NAMESPACE = 'launch_cache'
+
+    def __init__(self, ttl: float, store: Optional[StatsStore] = None):
+        self.ttl = ttl
+        self.store = store
+        self._generation: Optional[str] = None
+        # version -> (traces, fingerprint, expires at)
+        self._entries: Dict[str, Tuple[List[dict], str, float]] = {}
+        # version -> (fingerprint, user_id) of the first launch seen
+        self._candidates: Dict[str, Tuple[str, str]] = {}
+        # version -> time until which launches are treated as per-user
+        self._uncacheable: Dict[str, float] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, version: str) -> Optional[List[dict]]:
+        """Return the cached launch traces for a version, counting the hit or miss"""
+        entry = self._entries.get(version)
+        if entry is None or time.monotonic() >= entry[2]:
+            if entry is not None:
+                del self._entries[version]
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0]
+
+    def offer(self, version: str, user_id: str, traces: List[dict], identifiers: Iterable[str] = ()) -> bool:
+        """
+        Report the traces a user got from a real launch. Returns False if they do not
+        match the cached traces, in which case the entry is dropped.
+        """
+        now = time.monotonic()
+        if not traces or self._uncacheable.get(version, 0) > now:
+            return True
+        if self._mentions(traces, [user_id, *identifiers]):
+            was_cached = version in self._entries
+            self._mark_uncacheable(version, "launch traces mention the user")
+            return not was_cached
+
+        fingerprint = _fingerprint(traces)
+        entry = self._entries.get(version)
+        if entry is not None:
+            if entry[1] == fingerprint:
+                return True
+            self._mark_uncacheable(version, "launch traces changed between users")
+            return False
+
+        candidate = self._candidates.get(version)
+        if candidate is None or candidate[1] == user_id:
+            self._candidates[version] = (fingerprint, user_id)
+        elif candidate[0] == fingerprint:
+            self._entries[version] = (traces, fingerprint, now + self.ttl)
+            del self._candidates[version]
+            logger.info(f"Cached launch traces for version {version}")
+        else:
+            self._mark_uncacheable(version, "launch traces differ between users")
+        return True
+
+    def invalidate(self, version: Optional[str] = None) -> int:
+        """Drop cached launches of one version, or of all versions; returns the number dropped"""
+        versions = [version] if version else list(self._entries)
+        dropped = 0
+        for key in versions:
+            dropped += self._entries.pop(key, None) is not None
+            self._candidates.pop(key, None)
+            self._uncacheable.pop(key, None)
+        if not version:
+            self._candidates.clear()
+            self._uncacheable.clear()
+        return dropped
+
+    async def clear(self, version: Optional[str] = None) -> int:
+        """Invalidate in this process and tell the other worker processes to do the same"""
+        dropped = self.invalidate(version)
+        if self.store is not None:
+            self._generation = secrets.token_hex(8)
+            await asyncio.to_thread(self.store.set_value, self.NAMESPACE, 'generation', self._generation)
+        return dropped
+
+    async def sync(self):
+        """Drop all cached launches if another process cleared the cache since the last sync"""
+        if self.store is None:
+            return
+        generation = await asyncio.to_thread(self.store.get_value, self.NAMESPACE, 'generation')
+        if generation != self._generation:
+            # Clears of single versions may have been missed in between, so drop everything
+            if self._generation is not None or generation is not None:
+                self.invalidate()
+            self._generation = generation
+
+    def _mark_uncacheable(self, version: str, reason: str):
+        self._entries.pop(version, None)
+        self._candidates.pop(version, None)
+        self._uncacheable[version] = time.monotonic() + self.ttl
+        logger.info(f"Not caching launch traces for version {version}: {reason}")
+
+    @staticmethod
+    def _mentions(traces: List[dict], identifiers: Iterable[str]) -> bool:
+        text = json.dumps(traces, default=str).lower()
+        return any(
+            identifier and len(identifier) >= _MIN_IDENTIFIER_LENGTH and identifier.lower() in text
+            for identifier in identifiers
+        )
@@ -0,0 +1,71 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+from storage import StatsStore
+
+logger = logging.getLogger(__name__)
+
+class FileIdCache:
+    """
+    LRU/TTL cache from media URL to Telegram file_id, so assets Telegram has already
+    fetched once are re-sent by reference instead of being downloaded again.
+    """
+
+    NAMESPACE = 'file_ids'
+
+    def __init__(self, max_size: int, ttl: float, store: Optional[StatsStore] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.store = store
+        self._entries: 'OrderedDict[str, Tuple[str, float]]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def load(self):
+        """Warm the cache from the persistent store"""
+        if self.store is None:
+            return
+        data = await asyncio.to_thread(self.store.get_value, self.NAMESPACE, 'entries')
+        if not data:
+            return
+        now = time.time()
+        for url, (file_id, stored_at) in json.loads(data)[-self.max_size:]:
+            if now - stored_at < self.ttl:
+                self._entries[url] = (file_id, stored_at)
+        logger.info(f"Loaded {len(self._entries)} cached file IDs")
+
+    async def save(self):
+        """Persist the current entries"""
+        if self.store is None:
+            return
+        data = json.dumps([[url, list(entry)] for url, entry in self._entries.items()])
+        await asyncio.to_thread(self.store.set_value, self.NAMESPACE, 'entries', data)
+
+    def get(self, url: str) -> Optional[str]:
+        """Return the cached file_id for a URL, counting the hit or miss"""
+        entry = self._entries.get(url)
+        if entry is None or time.time() - entry[1] >= self.ttl:
+            if entry is not None:
+                del self._entries[url]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(url)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, url: str, file_id: str):
+        """Remember the file_id Telegram assigned to a URL"""
+        self._entries[url] = (file_id, time.time())
+        self._entries.move_to_end(url)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, url: str):
+        """Forget a URL whose cached file_id stopped working"""
+        self._entries.pop(url, None)
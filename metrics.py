@@ -0,0 +1,256 @@
+import asyncio
+import bisect
+import contextvars
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+from telegram.request import HTTPXRequest
+from http_server import HttpRequest, HttpResponse, HttpServer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _format_labels(names: Sequence[str], values: Tuple[str, ...], extra: str = '') -> str:
+    parts = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def total(self) -> float:
+        return sum(self._values.values())
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {value}")
+        return lines
+
+class Histogram:
+    """Fixed-bucket histogram with optional labels; observe() is a bisect and two additions"""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def count(self) -> int:
+        return sum(series[2] for series in self._series.values())
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate a quantile over all label combinations by interpolating within buckets"""
+        counts = [0] * (len(self.buckets) + 1)
+        for series in self._series.values():
+            counts = [a + b for a, b in zip(counts, series[0])]
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                if index == len(self.buckets):
+                    return lower
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+class Registry:
+    """Collection of metrics rendered together in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: List = []
+
+    def counter(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help_text, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+UPDATE_QUEUE_WAIT = REGISTRY.histogram(
+    'bot_update_queue_wait_seconds', 'Time an update waited for its user lane and a worker slot')
+UPDATE_DURATION = REGISTRY.histogram(
+    'bot_update_duration_seconds', 'Time spent processing an update once it started')
+UPDATES_DROPPED = REGISTRY.counter(
+    'bot_updates_dropped_total', 'Updates dropped because the per-user queue was full or they were duplicates',
+    labels=('reason',))
+MESSAGES_COALESCED = REGISTRY.counter(
+    'bot_messages_coalesced_total', 'Text messages merged into an earlier turn of the same user')
+VOICEFLOW_REQUEST = REGISTRY.histogram(
+    'bot_voiceflow_request_seconds', 'Voiceflow round trip time',
+    labels=('version', 'request_type', 'outcome'))
+RENDER_DURATION = REGISTRY.histogram(
+    'bot_render_seconds', 'Time to render a Voiceflow response to Telegram, including sends')
+TELEGRAM_REQUEST = REGISTRY.histogram(
+    'bot_telegram_request_seconds', 'Telegram Bot API request time', labels=('method', 'outcome'))
+ADMISSION_WAIT = REGISTRY.histogram(
+    'bot_admission_wait_seconds', 'Time a Voiceflow request waited for an admission slot')
+ADMISSION_REJECTED = REGISTRY.counter(
+    'bot_admission_rejected_total', 'Voiceflow requests shed by admission control', labels=('reason', 'priority'))
+
+class _Timeline(list):
+    """
+    Stage timings of one update. Tasks started while handling the update inherit it
+    through their context, so it is closed when the update finishes; a long-running
+    task such as a broadcast must not keep growing it.
+    """
+    closed = False
+
+# Stage timings of the update currently being processed
+_timeline: contextvars.ContextVar[Optional[_Timeline]] = contextvars.ContextVar('timeline', default=None)
+
+# Extra details of the update currently being processed, e.g. the Voiceflow exchange
+_annotations: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar('annotations', default=None)
+
+def _open_timeline() -> Optional[_Timeline]:
+    timeline = _timeline.get()
+    return None if timeline is None or timeline.closed else timeline
+
+def start_timeline() -> List[Tuple[str, float, float, Dict[str, str]]]:
+    """Begin collecting stage timings for the current update"""
+    timeline = _Timeline()
+    _timeline.set(timeline)
+    _annotations.set({})
+    return timeline
+
+def end_timeline():
+    """Stop collecting for the current update, including in tasks it started"""
+    timeline = _timeline.get()
+    if timeline is not None:
+        timeline.closed = True
+
+def current_timeline() -> Optional[List[Tuple[str, float, float, Dict[str, str]]]]:
+    return _timeline.get()
+
+def annotate(key: str, value: Any):
+    """Attach a detail to the current update; kept only if the turn is captured as slow"""
+    annotations = _annotations.get()
+    if annotations is not None and _open_timeline() is not None:
+        annotations[key] = value
+
+def current_annotations() -> Dict[str, Any]:
+    return _annotations.get() or {}
+
+def record_stage(stage: str, histogram: Histogram, started: float, duration: float, **labels):
+    """Observe a stage duration and add it to the current update's timeline"""
+    histogram.observe(duration, **labels)
+    timeline = _open_timeline()
+    if timeline is not None:
+        timeline.append((stage, started, duration, labels))
+
+@contextmanager
+def timed(stage: str, histogram: Histogram, **labels) -> Iterator[Dict[str, str]]:
+    """
+    Time a block as a stage. Yields the label dict so the block can fill in labels that
+    are only known at the end; 'outcome' is set to 'error' if the block raises
+    and to 'cancelled' if it is cancelled.
+    """
+    started = time.perf_counter()
+    if 'outcome' in histogram.labels:
+        labels.setdefault('outcome', 'ok')
+    try:
+        yield labels
+    except asyncio.CancelledError:
+        if 'outcome' in histogram.labels:
+            labels['outcome'] = 'cancelled'
+        raise
+    except BaseException:
+        if 'outcome' in histogram.labels:
+            labels['outcome'] = 'error'
+        raise
+    finally:
+        record_stage(stage, histogram, started, time.perf_counter() - started, **labels)
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that times every Telegram Bot API call by method"""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        with timed('telegram', TELEGRAM_REQUEST, method=api_method):
+            return await super().do_request(url, method, *args, **kwargs)
+
+def stats_summary() -> str:
+    """Short latency summary for the /stats command"""
+    def fmt(histogram: Histogram) -> str:
+        p50, p95 = histogram.quantile(0.5), histogram.quantile(0.95)
+        if p50 is None:
+            return "n/a"
+        return f"{p50 * 1000:.0f}/{p95 * 1000:.0f} ms"
+
+    return (
+        f"⏱ Latency p50/p95 ({UPDATE_DURATION.count()} updates):\n"
+        f"Queue wait: {fmt(UPDATE_QUEUE_WAIT)}\n"
+        f"Admission wait: {fmt(ADMISSION_WAIT)}\n"
+        f"Update total: {fmt(UPDATE_DURATION)}\n"
+        f"Voiceflow: {fmt(VOICEFLOW_REQUEST)}\n"
+        f"Rendering: {fmt(RENDER_DURATION)}\n"
+        f"Telegram send: {fmt(TELEGRAM_REQUEST)}\n"
+        f"Dropped updates: {UPDATES_DROPPED.total():.0f}\n"
+        f"Shed requests: {ADMISSION_REJECTED.total():.0f}"
+    )
+
+def create_metrics_server(host: str, port: int) -> HttpServer:
+    """HTTP server exposing the registry at /metrics"""
+    server = HttpServer(host, port)
+
+    async def metrics(request: HttpRequest) -> HttpResponse:
+        return HttpResponse(200, REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+    server.add_route('GET', '/metrics', metrics)
+    return server
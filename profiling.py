@@ -0,0 +1,103 @@
+import asyncio
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Any, Deque, Dict
+from telegram import Update
+from metrics import current_timeline, current_annotations
+
+logger = logging.getLogger(__name__)
+
+def _frame_label(code) -> str:
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}:{code.co_firstlineno}"
+
+class SamplingProfiler:
+    """
+    Samples the event loop thread's Python stack from a background thread and reports
+    the result as collapsed stacks ("outer;inner count" per line), the input format of
+    flamegraph.pl, speedscope and similar tools.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.running = False
+
+    def _sample(self, thread_id: int, stop: threading.Event, counts: Counter):
+        while not stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                counts[";".join(reversed(stack))] += 1
+
+    async def profile(self, seconds: float) -> str:
+        """Profile the running event loop for the given number of seconds"""
+        if self.running:
+            raise RuntimeError("A profile is already running")
+        self.running = True
+        counts: Counter = Counter()
+        stop = threading.Event()
+        sampler = threading.Thread(
+            target=self._sample, args=(threading.get_ident(), stop, counts), name='profiler', daemon=True
+        )
+        try:
+            sampler.start()
+            await asyncio.sleep(seconds)
+        finally:
+            stop.set()
+            await asyncio.to_thread(sampler.join)
+            self.running = False
+        logger.info(f"Collected {sum(counts.values())} profile samples over {seconds:g}s")
+        return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+class SlowTurnRecorder:
+    """
+    Keeps the stage timeline and Voiceflow exchange of updates slower than the
+    threshold in a ring buffer. A threshold of 0 disables capturing.
+    """
+
+    def __init__(self, threshold: float, capacity: int):
+        self.threshold = threshold
+        self._captures: Deque[Dict[str, Any]] = deque(maxlen=capacity)
+        self.captured = 0
+
+    def __len__(self) -> int:
+        return len(self._captures)
+
+    def on_finish(self, update: object, started: float, duration: float):
+        """Called by the update processor after every update, in the update's context"""
+        if not self.threshold or duration < self.threshold:
+            return
+        timeline = current_timeline() or []
+        capture: Dict[str, Any] = {
+            'ts': time.time(),
+            'duration_ms': round(duration * 1000, 1),
+            'stages': [
+                {'stage': stage, 'offset_ms': round((stage_started - started) * 1000, 1),
+                 'duration_ms': round(stage_duration * 1000, 1), **labels}
+                for stage, stage_started, stage_duration, labels in timeline
+            ],
+            **current_annotations()
+        }
+        if isinstance(update, Update):
+            capture['update_id'] = update.update_id
+            capture['user_id'] = update.effective_user.id if update.effective_user else None
+            capture['kind'] = 'callback' if update.callback_query else 'message' if update.message else 'other'
+        self._captures.append(capture)
+        self.captured += 1
+        logger.info(f"Captured slow turn ({capture['duration_ms']} ms)")
+
+    def clear(self):
+        self._captures.clear()
+
+    def dump(self) -> bytes:
+        """Captured turns as JSONL, oldest first"""
+        return "".join(
+            json.dumps(capture, ensure_ascii=False, default=str) + "\n" for capture in self._captures
+        ).encode('utf-8')
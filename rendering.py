@@ -0,0 +1,266 @@
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, List, Optional
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto, Message
+from telegram.constants import ChatAction
+from telegram.error import BadRequest
+from media_cache import FileIdCache
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_LENGTH = 4096
+MAX_MEDIA_GROUP_SIZE = 10
+CHOICE_PROMPT = "Please choose an option:"
+END_MESSAGE = "Conversation ended. You can start a new one with /start"
+
+class RenderStep:
+    """One Telegram request produced from one or more Voiceflow traces"""
+
+    def __init__(self, kind: str, text: str = '', images: Optional[List[str]] = None,
+                 reply_markup: Optional[InlineKeyboardMarkup] = None):
+        self.kind = kind  # 'text' or 'photos'
+        self.text = text
+        self.images = images or []
+        self.reply_markup = reply_markup
+
+def build_choice_keyboard(buttons: List[Dict], callback_data: Callable[[Dict], str]) -> InlineKeyboardMarkup:
+    """Build the inline keyboard for a Voiceflow choice trace"""
+    keyboard = []
+    for button in buttons:
+        keyboard.append([InlineKeyboardButton(button['name'], callback_data=callback_data(button))])
+    return InlineKeyboardMarkup(keyboard)
+
+def _add_text(steps: List[RenderStep], text: str):
+    last = steps[-1] if steps else None
+    if last and last.kind == 'text' and last.reply_markup is None \
+            and len(last.text) + 2 + len(text) <= MAX_MESSAGE_LENGTH:
+        last.text = f"{last.text}\n\n{text}"
+        return
+    for start in range(0, len(text), MAX_MESSAGE_LENGTH):
+        steps.append(RenderStep('text', text=text[start:start + MAX_MESSAGE_LENGTH]))
+
+def _add_image(steps: List[RenderStep], image: str):
+    last = steps[-1] if steps else None
+    if last and last.kind == 'photos' and len(last.images) < MAX_MEDIA_GROUP_SIZE:
+        last.images.append(image)
+    else:
+        steps.append(RenderStep('photos', images=[image]))
+
+def _add_choice(steps: List[RenderStep], reply_markup: InlineKeyboardMarkup):
+    last = steps[-1] if steps else None
+    if last and last.kind == 'text' and last.reply_markup is None:
+        last.reply_markup = reply_markup
+    else:
+        steps.append(RenderStep('text', text=CHOICE_PROMPT, reply_markup=reply_markup))
+
+def plan_traces(traces: List[Dict], callback_data: Callable[[Dict], str]) -> List[RenderStep]:
+    """
+    Turn a Voiceflow trace list into the smallest ordered list of Telegram requests:
+    adjacent texts are merged, consecutive images grouped and choice keyboards
+    attached to the preceding text message. ``callback_data`` maps a Voiceflow
+    button to the callback_data placed on its inline button.
+    """
+    steps: List[RenderStep] = []
+    for trace in traces:
+        trace_type = trace.get('type')
+        try:
+            payload = trace.get('payload') or {}
+            if trace_type in ['text', 'speak']:
+                message = payload.get('message')
+                if message:
+                    _add_text(steps, message)
+            elif trace_type == 'visual':
+                image_url = payload.get('image')
+                if image_url:
+                    _add_image(steps, image_url)
+            elif trace_type == 'choice':
+                buttons = payload.get('buttons', [])
+                if buttons:
+                    _add_choice(steps, build_choice_keyboard(buttons, callback_data))
+            elif trace_type == 'end':
+                _add_text(steps, END_MESSAGE)
+        except (KeyError, TypeError, AttributeError) as e:
+            logger.error(f"Skipping malformed {trace_type} trace: {str(e)}")
+    return steps
+
+def _photo_file_id(message: Message) -> Optional[str]:
+    return message.photo[-1].file_id if message and message.photo else None
+
+async def _send_photos(msg_obj: Message, images: List[str], file_ids: Optional[FileIdCache]):
+    cached = [file_ids.get(image) if file_ids else None for image in images]
+    media = [file_id or image for file_id, image in zip(cached, images)]
+    try:
+        if len(media) == 1:
+            sent = [await msg_obj.reply_photo(media[0])]
+        else:
+            sent = await msg_obj.reply_media_group([InputMediaPhoto(item) for item in media])
+    except BadRequest:
+        if not any(cached):
+            raise
+        # A cached file_id was rejected; drop the cached ones and send by URL
+        logger.warning("Cached file_id rejected by Telegram, resending by URL")
+        for image, file_id in zip(images, cached):
+            if file_id:
+                file_ids.invalidate(image)
+        return await _send_photos(msg_obj, images, file_ids)
+
+    if file_ids is not None:
+        for image, file_id, message in zip(images, cached, sent):
+            new_file_id = _photo_file_id(message)
+            if not file_id and new_file_id:
+                file_ids.put(image, new_file_id)
+
+async def send_step(msg_obj: Message, step: RenderStep, file_ids: Optional[FileIdCache] = None):
+    """Send a single planned step as a reply to the given message"""
+    if step.kind == 'text':
+        await msg_obj.reply_text(step.text, reply_markup=step.reply_markup)
+    else:
+        await _send_photos(msg_obj, step.images, file_ids)
+
+class StreamingRenderer:
+    """
+    Render traces as they arrive from a streaming Voiceflow interaction. Text is
+    delivered immediately and then grown in place by editing the same message,
+    with edits throttled to ``edit_interval`` seconds.
+    """
+
+    TYPING_INTERVAL = 4.5
+
+    def __init__(self, msg_obj: Message, callback_data: Callable[[Dict], str],
+                 file_ids: Optional[FileIdCache], edit_interval: float):
+        self.msg_obj = msg_obj
+        self.callback_data = callback_data
+        self.file_ids = file_ids
+        self.edit_interval = edit_interval
+        self.rendered_anything = False
+        self._message: Optional[Message] = None  # Text message currently being grown
+        self._text = ''
+        self._sent_text = ''
+        self._markup: Optional[InlineKeyboardMarkup] = None
+        self._last_edit = 0.0
+        self._images: List[str] = []
+        self._lock = asyncio.Lock()
+        self._edit_task: Optional[asyncio.Task] = None
+        self._typing_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Show the typing indicator until the turn is complete, without waiting for Telegram"""
+        self._typing_task = asyncio.create_task(self._keep_typing())
+
+    async def add(self, trace: Dict):
+        """Render one trace"""
+        trace_type = trace.get('type')
+        payload = trace.get('payload') or {}
+        try:
+            if trace_type in ['text', 'speak']:
+                if payload.get('message'):
+                    await self._append_text(payload['message'], separator='\n\n')
+            elif trace_type == 'completion':
+                # Streamed LLM output: 'start' opens a block, 'content' carries text chunks
+                if payload.get('state') == 'start':
+                    await self._close_text()
+                elif payload.get('content'):
+                    await self._append_text(payload['content'], separator='')
+            elif trace_type == 'visual':
+                if payload.get('image'):
+                    await self._close_text()
+                    self._images.append(payload['image'])
+                    if len(self._images) == MAX_MEDIA_GROUP_SIZE:
+                        await self._flush_images()
+            elif trace_type == 'choice':
+                if payload.get('buttons'):
+                    await self._add_choice(build_choice_keyboard(payload['buttons'], self.callback_data))
+            elif trace_type == 'end':
+                await self._append_text(END_MESSAGE, separator='\n\n')
+        except (KeyError, TypeError, AttributeError) as e:
+            logger.error(f"Skipping malformed {trace_type} trace: {str(e)}")
+
+    async def finish(self):
+        """Deliver everything still buffered and stop the typing indicator"""
+        if self._typing_task is not None:
+            self._typing_task.cancel()
+        await self._flush_images()
+        await self._close_text()
+
+    async def _append_text(self, text: str, separator: str):
+        await self._flush_images()
+        if self._message is not None and self._markup is None \
+                and len(self._text) + len(separator) + len(text) <= MAX_MESSAGE_LENGTH:
+            self._text = f"{self._text}{separator}{text}" if self._text else text
+            await self._schedule_edit()
+            return
+        await self._close_text()
+        self._text = text[:MAX_MESSAGE_LENGTH]
+        self._message = await self.msg_obj.reply_text(self._text)
+        self._sent_text = self._text
+        self._last_edit = time.monotonic()
+        self.rendered_anything = True
+        if len(text) > MAX_MESSAGE_LENGTH:
+            await self._append_text(text[MAX_MESSAGE_LENGTH:], separator='')
+
+    async def _add_choice(self, reply_markup: InlineKeyboardMarkup):
+        await self._flush_images()
+        if self._message is not None and self._markup is None:
+            self._markup = reply_markup
+            await self._edit(force=True)
+        else:
+            await self._close_text()
+            await self.msg_obj.reply_text(CHOICE_PROMPT, reply_markup=reply_markup)
+            self.rendered_anything = True
+        await self._close_text()
+
+    async def _schedule_edit(self):
+        delay = self.edit_interval - (time.monotonic() - self._last_edit)
+        if delay <= 0:
+            await self._edit()
+        elif self._edit_task is None or self._edit_task.done():
+            self._edit_task = asyncio.create_task(self._delayed_edit(delay))
+
+    async def _delayed_edit(self, delay: float):
+        await asyncio.sleep(delay)
+        try:
+            await self._edit()
+        except Exception as e:
+            # Nobody awaits this task; the text is sent again by the next edit or by _close_text
+            logger.warning(f"Could not update streamed message: {str(e)}")
+
+    async def _edit(self, force: bool = False):
+        async with self._lock:
+            if self._message is None or (self._text == self._sent_text and not force):
+                return
+            try:
+                self._message = await self._message.edit_text(self._text, reply_markup=self._markup) or self._message
+                self._sent_text = self._text
+            except BadRequest as e:
+                if 'not modified' not in str(e).lower():
+                    raise
+            finally:
+                self._last_edit = time.monotonic()
+
+    async def _close_text(self):
+        """Finish the message being grown so later text starts a new one"""
+        if self._edit_task is not None and not self._edit_task.done():
+            self._edit_task.cancel()
+        await self._edit()
+        self._message = None
+        self._text = ''
+        self._sent_text = ''
+        self._markup = None
+
+    async def _flush_images(self):
+        images, self._images = self._images, []
+        if images:
+            await _send_photos(self.msg_obj, images, self.file_ids)
+            self.rendered_anything = True
+
+    async def _keep_typing(self):
+        while True:
+            await self._send_typing()
+            await asyncio.sleep(self.TYPING_INTERVAL)
+
+    async def _send_typing(self):
+        try:
+            await self.msg_obj.reply_chat_action(ChatAction.TYPING)
+        except Exception as e:
+            logger.warning(f"Could not send typing action: {str(e)}")
@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Optional, TypeVar
+import httpx
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected because the circuit breaker is open"""
+
+class CircuitBreaker:
+    """
+    Classic closed/open/half-open circuit breaker. After ``failure_threshold``
+    consecutive failures calls fail fast for ``recovery_timeout`` seconds, then a
+    limited number of trial calls decide whether to close the circuit again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, failure_threshold: int, recovery_timeout: float, half_open_max_calls: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_calls = 0
+
+    def before_call(self):
+        """Check whether a call may go ahead; raises CircuitOpenError if not"""
+        if self.state == self.OPEN:
+            if time.monotonic() - self._opened_at < self.recovery_timeout:
+                raise CircuitOpenError(f"{self.name} circuit is open")
+            self.state = self.HALF_OPEN
+            self._trial_calls = 0
+            logger.info(f"{self.name} circuit half-open, sending trial requests")
+        if self.state == self.HALF_OPEN:
+            if time.monotonic() - self._opened_at >= 2 * self.recovery_timeout:
+                # Trial calls that never reported back must not keep the circuit stuck
+                self._opened_at = time.monotonic() - self.recovery_timeout
+                self._trial_calls = 0
+            if self._trial_calls >= self.half_open_max_calls:
+                raise CircuitOpenError(f"{self.name} circuit is half-open and waiting for trial requests")
+            self._trial_calls += 1
+
+    def record_success(self):
+        """Report a successful call"""
+        if self.state != self.CLOSED:
+            logger.info(f"{self.name} circuit closed")
+        self.state = self.CLOSED
+        self._failures = 0
+
+    def record_failure(self):
+        """Report a failed call"""
+        self._failures += 1
+        if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"{self.name} circuit opened after {self._failures} failures")
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+
+def is_connect_error(error: BaseException) -> bool:
+    """Errors raised before the request reached the server, safe to retry for any call"""
+    return isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+
+def is_transient_error(error: BaseException) -> bool:
+    """Errors worth retrying for idempotent calls"""
+    if isinstance(error, httpx.HTTPStatusError):
+        status_code = error.response.status_code
+        return status_code >= 500 or status_code == 429
+    return isinstance(error, (httpx.TransportError, TimeoutError))
+
+class RetryPolicy:
+    """Exponential backoff with full jitter"""
+
+    def __init__(self, max_attempts: int, base_delay: float, max_delay: float):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt: int) -> float:
+        """Delay before retry number ``attempt`` (starting at 1)"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    async def call(self, func: Callable[[], Awaitable[T]], retryable: Callable[[BaseException], bool]) -> T:
+        """Run ``func`` until it succeeds, the error is not retryable or attempts run out"""
+        attempt = 1
+        while True:
+            try:
+                return await func()
+            except Exception as e:
+                if attempt >= self.max_attempts or not retryable(e):
+                    raise
+                delay = self.backoff(attempt)
+                logger.warning(f"Attempt {attempt} failed ({type(e).__name__}: {str(e)}), retrying in {delay:.2f}s")
+                attempt += 1
+                await asyncio.sleep(delay)
+
+class LatencyWindow:
+    """Rolling window of recent latencies used to pick the hedging delay"""
+
+    def __init__(self, size: int = 500):
+        self._samples: Deque[float] = deque(maxlen=size)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def observe(self, seconds: float):
+        self._samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class HedgeBudget:
+    """Limits hedged requests to a fraction of all requests so hedging cannot double the load"""
+
+    def __init__(self, ratio: float):
+        self.ratio = ratio
+        self.requests = 0
+        self.hedges = 0
+
+    def record_request(self):
+        self.requests += 1
+
+    def try_spend(self) -> bool:
+        if self.hedges + 1 > self.ratio * self.requests:
+            return False
+        self.hedges += 1
+        return True
+
+async def hedged(func: Callable[[], Awaitable[T]], delay: Optional[float], budget: HedgeBudget) -> T:
+    """
+    Run ``func`` and, if it has not finished after ``delay`` seconds, start a second
+    attempt. The first attempt to succeed wins and the other one is cancelled.
+    """
+    budget.record_request()
+    first = asyncio.ensure_future(func())
+    if delay is None:
+        return await first
+
+    tasks = {first}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done and budget.try_spend():
+            logger.info(f"Request exceeded {delay:.2f}s, sending a hedged request")
+            tasks.add(asyncio.ensure_future(func()))
+        error: Optional[BaseException] = None
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = error or task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
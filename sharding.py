@@ -0,0 +1,258 @@
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import multiprocessing
+import queue
+import signal
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+from telegram import Update
+from telegram.ext import Application, ContextTypes, TypeHandler
+from config import TELEGRAM_TOKEN, WORKER_PROCESSES, WORKER_DRAIN_TIMEOUT, BOT_MODE
+from webhook import run_webhook
+
+logger = logging.getLogger(__name__)
+
+# Worker processes are started fresh instead of forked from the front process
+_MP = multiprocessing.get_context('spawn')
+# Sent through a worker's queue to make it finish its queued updates and exit
+_STOP = None
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+class ConsistentHashRing:
+    """Maps keys to nodes so that resizing the ring only moves a small share of the keys"""
+
+    def __init__(self, nodes: Iterable[int], replicas: int = 100):
+        points: List[Tuple[int, int]] = sorted(
+            (_hash(f"{node}:{replica}"), node) for node in nodes for replica in range(replicas)
+        )
+        if not points:
+            raise ValueError("A hash ring needs at least one node")
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, key: str) -> int:
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._nodes[index]
+
+def _routing_key(update: Update) -> str:
+    """Updates of one user always share a key, which keeps them in order on one worker"""
+    if update.effective_user:
+        return str(update.effective_user.id)
+    if update.effective_chat:
+        return str(update.effective_chat.id)
+    return ''
+
+def _worker_main(shard: int, shard_count: int, updates: 'multiprocessing.Queue', base_url: Optional[str]):
+    """Entry point of a worker process"""
+    # Ctrl+C reaches the whole process group; the front process coordinates the shutdown
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_run_worker(shard, shard_count, updates, base_url))
+
+async def _run_worker(shard: int, shard_count: int, updates: 'multiprocessing.Queue', base_url: Optional[str]):
+    from bot import build_application
+    from admin_handlers import BROADCASTS
+
+    BROADCASTS.shard = shard
+    BROADCASTS.shard_count = shard_count
+    application = build_application(base_url, updater=False, shard=shard)
+
+    stop_event = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop_event.set)
+
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        logger.info(f"Worker {shard} ready")
+        while not stop_event.is_set():
+            try:
+                data = await asyncio.to_thread(updates.get, True, 0.5)
+            except queue.Empty:
+                continue
+            if data is _STOP:
+                break
+            try:
+                update = Update.de_json(json.loads(data), application.bot)
+            except (ValueError, TypeError, KeyError) as e:
+                logger.error(f"Worker {shard} received a malformed update: {str(e)}")
+                continue
+            await application.update_queue.put(update)
+    finally:
+        logger.info(f"Worker {shard} draining")
+        # Stopping the application processes the updates that are already queued
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        logger.info(f"Worker {shard} stopped")
+
+class ShardSupervisor:
+    """
+    Runs the worker processes, routes updates to them by user, and restarts workers
+    that die. Updates routed to a worker while it is down are held in the front
+    process, up to MAX_HELD_UPDATES per worker, and handed to its replacement.
+    Updates queued to the worker before its death was noticed are lost with its queue.
+    """
+
+    MONITOR_INTERVAL = 1.0
+    MAX_RESTART_DELAY = 30.0
+    # A worker that stayed up this long has its crash count reset
+    STABLE_AFTER = 60.0
+    # Updates kept for a worker that is down; the oldest are dropped beyond this
+    MAX_HELD_UPDATES = 10000
+
+    def __init__(self, workers: int, drain_timeout: float, base_url: Optional[str] = None):
+        if workers < 1:
+            raise ValueError("workers must be a positive integer")
+        self.workers = workers
+        self.drain_timeout = drain_timeout
+        self.base_url = base_url
+        self.ring = ConsistentHashRing(range(workers))
+        self._queues = [_MP.Queue() for _ in range(workers)]
+        self._processes: Dict[int, multiprocessing.Process] = {}
+        self._started_at: Dict[int, float] = {}
+        self._crashes: Dict[int, int] = {}
+        self._restart_at: Dict[int, float] = {}
+        # Updates of workers that are down, waiting for their replacement
+        self._held: Dict[int, Deque[str]] = {}
+        self._held_dropped: Dict[int, int] = {}
+        self._monitor: Optional[asyncio.Task] = None
+        self.restarts = 0
+
+    def _spawn(self, shard: int):
+        process = _MP.Process(
+            target=_worker_main, args=(shard, self.workers, self._queues[shard], self.base_url),
+            name=f"bot-worker-{shard}", daemon=False
+        )
+        process.start()
+        self._processes[shard] = process
+        self._started_at[shard] = time.monotonic()
+        logger.info(f"Started worker {shard} (pid {process.pid})")
+
+    async def start(self):
+        """Start all workers and watch over them"""
+        for shard in range(self.workers):
+            self._spawn(shard)
+        self._monitor = asyncio.create_task(self._watch())
+
+    def dispatch(self, update: Update):
+        """Queue an update on the worker that owns its user"""
+        shard = self.ring.node_for(_routing_key(update))
+        held = self._held.get(shard)
+        if held is None:
+            self._queues[shard].put_nowait(update.to_json())
+            return
+        if len(held) >= self.MAX_HELD_UPDATES:
+            held.popleft()
+            self._held_dropped[shard] += 1
+        held.append(update.to_json())
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.MONITOR_INTERVAL)
+            now = time.monotonic()
+            for shard, process in list(self._processes.items()):
+                if process.is_alive():
+                    if now - self._started_at[shard] >= self.STABLE_AFTER:
+                        self._crashes[shard] = 0
+                    continue
+                if shard not in self._restart_at:
+                    crashes = self._crashes.get(shard, 0) + 1
+                    self._crashes[shard] = crashes
+                    delay = min(self.MAX_RESTART_DELAY, 2 ** (crashes - 1))
+                    self._restart_at[shard] = now + delay
+                    self._hold(shard)
+                    logger.error(
+                        f"Worker {shard} exited with code {process.exitcode}, restarting in {delay:.0f}s"
+                    )
+                elif now >= self._restart_at[shard]:
+                    del self._restart_at[shard]
+                    process.close()
+                    self.restarts += 1
+                    self._queues[shard] = _MP.Queue()
+                    self._spawn(shard)
+                    self._release(shard)
+
+    def _hold(self, shard: int):
+        """Keep the updates of a dead worker in the front process until it is replaced"""
+        self._held[shard] = deque()
+        self._held_dropped[shard] = 0
+        # A killed worker can leave the queue's read lock held, so the replacement gets a new
+        # queue. Don't let the feeder thread of the old one block the front process on exit.
+        old = self._queues[shard]
+        old.close()
+        old.cancel_join_thread()
+
+    def _release(self, shard: int):
+        """Hand the updates held for a worker to its replacement"""
+        held = self._held.pop(shard)
+        dropped = self._held_dropped.pop(shard)
+        for data in held:
+            self._queues[shard].put_nowait(data)
+        if held:
+            logger.info(f"Handed {len(held)} held updates to the restarted worker {shard}")
+        if dropped:
+            logger.warning(f"Dropped {dropped} updates for worker {shard} while it was down")
+
+    async def stop(self):
+        """Let every worker finish its queued updates, then stop it"""
+        if self._monitor:
+            self._monitor.cancel()
+            try:
+                await self._monitor
+            except asyncio.CancelledError:
+                pass
+        for shard, held in self._held.items():
+            if held:
+                logger.warning(f"Dropping {len(held)} updates held for worker {shard}, which is down")
+        for shard, process in self._processes.items():
+            if process.is_alive():
+                self._queues[shard].put(_STOP)
+        deadline = time.monotonic() + self.drain_timeout
+        for shard, process in self._processes.items():
+            await asyncio.to_thread(process.join, max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"Worker {shard} did not drain in time, terminating it")
+                process.terminate()
+                await asyncio.to_thread(process.join, 5)
+        logger.info("All workers stopped")
+
+def build_front_application(supervisor: ShardSupervisor) -> Application:
+    """Application that only receives updates and hands them to the workers"""
+
+    async def route(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        supervisor.dispatch(update)
+
+    async def post_init(application: Application):
+        await supervisor.start()
+
+    async def post_shutdown(application: Application):
+        await supervisor.stop()
+
+    application = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+    application.add_handler(TypeHandler(Update, route))
+    return application
+
+def run_sharded():
+    """Run the bot as a front process that routes updates to WORKER_PROCESSES workers"""
+    supervisor = ShardSupervisor(WORKER_PROCESSES, WORKER_DRAIN_TIMEOUT)
+    application = build_front_application(supervisor)
+    logger.info(f"Starting front process in {BOT_MODE} mode with {WORKER_PROCESSES} workers...")
+    if BOT_MODE == 'webhook':
+        asyncio.run(run_webhook(application))
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional
+from storage import HyperLogLog, StatsBatch, StatsStore
+
+logger = logging.getLogger(__name__)
+
+class StatsRecorder:
+    """
+    Write-behind recorder for user statistics. Updates are collected in memory and
+    flushed to the store in batches from a background task, so recording is O(1)
+    and never waits on disk.
+    """
+
+    def __init__(self, store: StatsStore, flush_interval: float, max_pending: int):
+        self.store = store
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._batch = StatsBatch()
+        self._task: Optional[asyncio.Task] = None
+        self._flush_requested: Optional[asyncio.Event] = None
+
+    def record(self, user_id: str):
+        """Count one message from the given user"""
+        now = int(time.time())
+        hour = now // 3600
+        day = hour // 24
+        batch = self._batch
+        batch.users.add(user_id)
+        batch.messages += 1
+        batch.hourly[hour] = batch.hourly.get(hour, 0) + 1
+        sketch = batch.daily.get(day)
+        if sketch is None:
+            sketch = batch.daily[day] = HyperLogLog()
+        sketch.add(user_id)
+        if len(batch.users) >= self.max_pending and self._flush_requested is not None:
+            self._flush_requested.set()
+
+    async def start(self):
+        """Start the background flush task"""
+        self._flush_requested = asyncio.Event()
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Stop the flush task and write everything still pending"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def flush(self):
+        """Write the pending batch to the store"""
+        batch, self._batch = self._batch, StatsBatch()
+        if not batch.messages:
+            return
+        try:
+            await asyncio.to_thread(self.store.apply_batch, batch)
+        except Exception as e:
+            logger.error(f"Failed to flush statistics, {batch.messages} messages dropped: {str(e)}")
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            await self.flush()
+
+    async def snapshot(self) -> Dict[str, Any]:
+        """Read totals and time-windowed breakdowns from the pre-aggregated buckets"""
+        hour = int(time.time()) // 3600
+        day = hour // 24
+        # Copy the pending batch on the event loop before reading the store in a thread
+        pending_messages = self._batch.messages
+        pending_hourly = dict(self._batch.hourly)
+        pending_daily = [(d, HyperLogLog(registers=s.to_bytes())) for d, s in self._batch.daily.items()]
+        return await asyncio.to_thread(
+            self._read_snapshot, hour, day, pending_messages, pending_hourly, pending_daily
+        )
+
+    def _read_snapshot(self, hour, day, pending_messages, pending_hourly, pending_daily) -> Dict[str, Any]:
+        hourly = dict(self.store.hourly_messages(hour - 23))
+        for bucket_hour, count in pending_hourly.items():
+            hourly[bucket_hour] = hourly.get(bucket_hour, 0) + count
+
+        def active_users(since_day: int) -> int:
+            merged = HyperLogLog()
+            for sketch in self.store.daily_sketches(since_day):
+                merged.merge(sketch)
+            for sketch_day, sketch in pending_daily:
+                if sketch_day >= since_day:
+                    merged.merge(sketch)
+            return merged.count()
+
+        return {
+            'total_users': self.store.total_users(),
+            'total_messages': self.store.total_messages() + pending_messages,
+            'daily_active_users': active_users(day),
+            'weekly_active_users': active_users(day - 6),
+            'messages_last_hour': hourly.get(hour, 0),
+            'messages_last_24h': sum(c for h, c in hourly.items() if h > hour - 24),
+            'hourly_messages': [(h, hourly.get(h, 0)) for h in range(hour - 5, hour + 1)]
+        }
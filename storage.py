@@ -0,0 +1,368 @@
+import hashlib
+import json
+import logging
+import math
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+class HyperLogLog:
+    """Fixed-size cardinality sketch used for approximate unique-user counts"""
+
+    def __init__(self, precision: int = 12, registers: Optional[bytes] = None):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(registers) if registers else bytearray(self.size)
+
+    def add(self, value: str):
+        """Add a value to the sketch"""
+        hashed = int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+        index = hashed >> (64 - self.precision)
+        rest = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: 'HyperLogLog'):
+        """Merge another sketch of the same precision into this one"""
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def count(self) -> int:
+        """Estimate the number of distinct values added"""
+        alpha = 0.7213 / (1 + 1.079 / self.size)
+        estimate = alpha * self.size ** 2 / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.size and zeros:
+            # Small-range correction
+            estimate = self.size * math.log(self.size / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.registers)
+
+class StatsBatch:
+    """Counter updates collected in memory between two flushes"""
+
+    def __init__(self):
+        self.users: Set[str] = set()
+        self.messages = 0
+        self.hourly: Dict[int, int] = {}
+        self.daily: Dict[int, HyperLogLog] = {}
+
+    def __len__(self) -> int:
+        return len(self.users) + len(self.hourly) + len(self.daily)
+
+class StatsStore(ABC):
+    """Storage backend for admins, statistics and small persistent key/value data"""
+
+    @abstractmethod
+    def get_admins(self) -> Set[str]:
+        """Return all admin user IDs"""
+
+    @abstractmethod
+    def add_admin(self, user_id: str):
+        """Persist a new admin user ID"""
+
+    @abstractmethod
+    def apply_batch(self, batch: StatsBatch):
+        """Write a batch of counter updates"""
+
+    @abstractmethod
+    def total_users(self) -> int:
+        """Return the exact number of known users"""
+
+    @abstractmethod
+    def total_messages(self) -> int:
+        """Return the total number of messages counted"""
+
+    @abstractmethod
+    def get_users_after(self, after: Optional[str], limit: int) -> List[str]:
+        """Return up to ``limit`` user IDs ordered by ID, starting after ``after``"""
+
+    @abstractmethod
+    def hourly_messages(self, since_hour: int) -> List[Tuple[int, int]]:
+        """Return (hour, message count) buckets starting at ``since_hour``"""
+
+    @abstractmethod
+    def daily_sketches(self, since_day: int) -> List[HyperLogLog]:
+        """Return the daily active user sketches starting at ``since_day``"""
+
+    @abstractmethod
+    def get_value(self, namespace: str, key: str) -> Optional[str]:
+        """Read a persisted value"""
+
+    @abstractmethod
+    def set_value(self, namespace: str, key: str, value: str):
+        """Persist a value"""
+
+    @abstractmethod
+    def delete_value(self, namespace: str, key: str):
+        """Remove a persisted value"""
+
+    @abstractmethod
+    def get_callback(self, token: str) -> Optional[str]:
+        """Read a spilled callback button entry"""
+
+    @abstractmethod
+    def put_callbacks(self, items: Iterable[Tuple[str, str, float]], expired_before: float):
+        """Persist (token, entry, created_at) rows and delete rows created before ``expired_before``"""
+
+    def set_values(self, namespace: str, items: Iterable[Tuple[str, str]]):
+        """Persist several values at once"""
+        for key, value in items:
+            self.set_value(namespace, key, value)
+
+    def close(self):
+        """Release backend resources"""
+
+class MemoryStore(StatsStore):
+    """Process-local backend, mainly useful for development"""
+
+    def __init__(self):
+        self._admins: Set[str] = set()
+        self._users: Set[str] = set()
+        self._messages = 0
+        self._hourly: Dict[int, int] = {}
+        self._daily: Dict[int, HyperLogLog] = {}
+        self._values: Dict[Tuple[str, str], str] = {}
+        self._callbacks: Dict[str, Tuple[str, float]] = {}
+
+    def get_admins(self) -> Set[str]:
+        return set(self._admins)
+
+    def add_admin(self, user_id: str):
+        self._admins.add(user_id)
+
+    def apply_batch(self, batch: StatsBatch):
+        self._users.update(batch.users)
+        self._messages += batch.messages
+        for hour, count in batch.hourly.items():
+            self._hourly[hour] = self._hourly.get(hour, 0) + count
+        for day, sketch in batch.daily.items():
+            if day in self._daily:
+                self._daily[day].merge(sketch)
+            else:
+                self._daily[day] = sketch
+
+    def total_users(self) -> int:
+        return len(self._users)
+
+    def total_messages(self) -> int:
+        return self._messages
+
+    def get_users_after(self, after: Optional[str], limit: int) -> List[str]:
+        users = sorted(u for u in self._users if after is None or u > after)
+        return users[:limit]
+
+    def hourly_messages(self, since_hour: int) -> List[Tuple[int, int]]:
+        return sorted((h, c) for h, c in self._hourly.items() if h >= since_hour)
+
+    def daily_sketches(self, since_day: int) -> List[HyperLogLog]:
+        return [s for d, s in self._daily.items() if d >= since_day]
+
+    def get_value(self, namespace: str, key: str) -> Optional[str]:
+        return self._values.get((namespace, key))
+
+    def set_value(self, namespace: str, key: str, value: str):
+        self._values[(namespace, key)] = value
+
+    def delete_value(self, namespace: str, key: str):
+        self._values.pop((namespace, key), None)
+
+    def get_callback(self, token: str) -> Optional[str]:
+        entry = self._callbacks.get(token)
+        return entry[0] if entry else None
+
+    def put_callbacks(self, items: Iterable[Tuple[str, str, float]], expired_before: float):
+        for token, entry, created_at in items:
+            self._callbacks[token] = (entry, created_at)
+        self._callbacks = {t: e for t, e in self._callbacks.items() if e[1] >= expired_before}
+
+class SQLiteStore(StatsStore):
+    """SQLite backend in WAL mode; safe to share between threads and processes"""
+
+    RETENTION_HOURS = 24 * 35
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS admins (user_id TEXT PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS users (user_id TEXT PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS hourly_messages (hour INTEGER PRIMARY KEY, messages INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS daily_users (day INTEGER PRIMARY KEY, sketch BLOB NOT NULL);
+            CREATE TABLE IF NOT EXISTS kv (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                PRIMARY KEY (namespace, key)
+            );
+            CREATE TABLE IF NOT EXISTS callbacks (
+                token TEXT PRIMARY KEY,
+                entry TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS callbacks_created_at ON callbacks (created_at);
+        """)
+        self._migrate_callbacks()
+        logger.info(f"Opened SQLite store at {path}")
+
+    def _migrate_callbacks(self):
+        """Move callback entries spilled by older versions from the kv table to their own table"""
+        rows = self._conn.execute("SELECT key, value FROM kv WHERE namespace = 'callbacks'").fetchall()
+        if not rows:
+            return
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO callbacks (token, entry, created_at) VALUES (?, ?, ?)",
+                ((token, entry, json.loads(entry)[2]) for token, entry in rows)
+            )
+            self._conn.execute("DELETE FROM kv WHERE namespace = 'callbacks'")
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        logger.info(f"Moved {len(rows)} callback entries to the callbacks table")
+
+    def _counter(self, name: str) -> int:
+        row = self._conn.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def get_admins(self) -> Set[str]:
+        with self._lock:
+            return {row[0] for row in self._conn.execute("SELECT user_id FROM admins")}
+
+    def add_admin(self, user_id: str):
+        with self._lock:
+            self._conn.execute("INSERT OR IGNORE INTO admins (user_id) VALUES (?)", (user_id,))
+
+    def apply_batch(self, batch: StatsBatch):
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                before = conn.total_changes
+                conn.executemany("INSERT OR IGNORE INTO users (user_id) VALUES (?)", ((u,) for u in batch.users))
+                new_users = conn.total_changes - before
+                conn.executemany(
+                    "INSERT INTO counters (name, value) VALUES (?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                    [('total_users', new_users), ('total_messages', batch.messages)]
+                )
+                conn.executemany(
+                    "INSERT INTO hourly_messages (hour, messages) VALUES (?, ?) "
+                    "ON CONFLICT(hour) DO UPDATE SET messages = messages + excluded.messages",
+                    batch.hourly.items()
+                )
+                for day, sketch in batch.daily.items():
+                    row = conn.execute("SELECT sketch FROM daily_users WHERE day = ?", (day,)).fetchone()
+                    if row:
+                        sketch.merge(HyperLogLog(sketch.precision, row[0]))
+                    conn.execute(
+                        "INSERT OR REPLACE INTO daily_users (day, sketch) VALUES (?, ?)",
+                        (day, sketch.to_bytes())
+                    )
+                if batch.hourly:
+                    cutoff = max(batch.hourly) - self.RETENTION_HOURS
+                    conn.execute("DELETE FROM hourly_messages WHERE hour < ?", (cutoff,))
+                    conn.execute("DELETE FROM daily_users WHERE day < ?", (cutoff // 24,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def total_users(self) -> int:
+        with self._lock:
+            return self._counter('total_users')
+
+    def total_messages(self) -> int:
+        with self._lock:
+            return self._counter('total_messages')
+
+    def get_users_after(self, after: Optional[str], limit: int) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?",
+                (after or '', limit)
+            )
+            return [row[0] for row in rows]
+
+    def hourly_messages(self, since_hour: int) -> List[Tuple[int, int]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT hour, messages FROM hourly_messages WHERE hour >= ? ORDER BY hour", (since_hour,)
+            )
+            return list(rows)
+
+    def daily_sketches(self, since_day: int) -> List[HyperLogLog]:
+        with self._lock:
+            rows = self._conn.execute("SELECT sketch FROM daily_users WHERE day >= ?", (since_day,))
+            return [HyperLogLog(registers=row[0]) for row in rows]
+
+    def get_value(self, namespace: str, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM kv WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+            return row[0] if row else None
+
+    def set_value(self, namespace: str, key: str, value: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO kv (namespace, key, value) VALUES (?, ?, ?)", (namespace, key, value)
+            )
+
+    def set_values(self, namespace: str, items: Iterable[Tuple[str, str]]):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO kv (namespace, key, value) VALUES (?, ?, ?)",
+                    ((namespace, key, value) for key, value in items)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def delete_value(self, namespace: str, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM kv WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def get_callback(self, token: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT entry FROM callbacks WHERE token = ?", (token,)).fetchone()
+            return row[0] if row else None
+
+    def put_callbacks(self, items: Iterable[Tuple[str, str, float]], expired_before: float):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO callbacks (token, entry, created_at) VALUES (?, ?, ?)", items
+                )
+                self._conn.execute("DELETE FROM callbacks WHERE created_at < ?", (expired_before,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def create_store(backend: str, path: str) -> StatsStore:
+    """Create the storage backend selected in the configuration"""
+    if backend == 'memory':
+        return MemoryStore()
+    if backend == 'sqlite':
+        return SQLiteStore(path)
+    raise ValueError(f"Unknown storage backend: {backend}")
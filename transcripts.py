@@ -0,0 +1,274 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ('drop_oldest', 'drop_newest', 'block')
+
+class TranscriptSink(ABC):
+    """Destination of transcript batches; all methods are called from a worker thread"""
+
+    @abstractmethod
+    def write_batch(self, records: List[Dict[str, Any]]):
+        ...
+
+    @abstractmethod
+    def export(self, user_id: Optional[str], since: float, until: float, limit: int) -> Iterator[Dict[str, Any]]:
+        """Records of one user (or everyone) between two timestamps, oldest first"""
+
+    def close(self):
+        pass
+
+class JsonlSink(TranscriptSink):
+    """
+    Gzip-compressed JSONL files, one per process, rotated by size. Each batch is
+    appended as its own gzip member, so a file stays readable if the process dies.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, backups: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._path: Optional[str] = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _new_path(self) -> str:
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.gmtime())
+        return os.path.join(self.directory, f"transcripts-{stamp}-{os.getpid()}.jsonl.gz")
+
+    def _files(self) -> List[str]:
+        names = sorted(name for name in os.listdir(self.directory)
+                       if name.startswith('transcripts-') and name.endswith('.jsonl.gz'))
+        return [os.path.join(self.directory, name) for name in names]
+
+    @staticmethod
+    def _writer_alive(path: str) -> bool:
+        """Whether another live process may still be appending to the file"""
+        try:
+            pid = int(os.path.basename(path)[:-len('.jsonl.gz')].rsplit('-', 1)[1])
+        except ValueError:
+            return False
+        if pid == os.getpid():
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def _rotate(self):
+        self._path = self._new_path()
+        # Other worker processes may still be appending to their files, so only prune
+        # this process's files and those left behind by processes that have exited
+        files = [path for path in self._files() if not self._writer_alive(path)]
+        for path in files[:max(0, len(files) - self.backups)]:
+            os.remove(path)
+
+    def write_batch(self, records: List[Dict[str, Any]]):
+        lines = "".join(json.dumps(record, ensure_ascii=False, default=str) + "\n" for record in records)
+        with self._lock:
+            if self._path is None or not os.path.exists(self._path) or os.path.getsize(self._path) >= self.max_bytes:
+                self._rotate()
+            with gzip.open(self._path, 'at', encoding='utf-8') as f:
+                f.write(lines)
+
+    def export(self, user_id: Optional[str], since: float, until: float, limit: int) -> Iterator[Dict[str, Any]]:
+        count = 0
+        for path in self._files():
+            if os.path.getmtime(path) < since:
+                continue
+            try:
+                with gzip.open(path, 'rt', encoding='utf-8') as f:
+                    for line in f:
+                        record = json.loads(line)
+                        if since <= record['ts'] < until and (user_id is None or record['user_id'] == user_id):
+                            yield record
+                            count += 1
+                            if count >= limit:
+                                return
+            except (OSError, EOFError, ValueError) as e:
+                logger.warning(f"Skipping unreadable transcript file {path}: {str(e)}")
+
+class SQLiteSink(TranscriptSink):
+    """Transcripts in an SQLite table, indexed by user and time"""
+
+    def __init__(self, path: str, retention_days: float):
+        self.retention = retention_days * 86400
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS transcripts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ts REAL NOT NULL,
+                user_id TEXT NOT NULL,
+                record TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS transcripts_user_ts ON transcripts (user_id, ts);
+            CREATE INDEX IF NOT EXISTS transcripts_ts ON transcripts (ts);
+        """)
+
+    def write_batch(self, records: List[Dict[str, Any]]):
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    "INSERT INTO transcripts (ts, user_id, record) VALUES (?, ?, ?)",
+                    ((r['ts'], r['user_id'], json.dumps(r, ensure_ascii=False, default=str)) for r in records)
+                )
+                if self.retention:
+                    conn.execute("DELETE FROM transcripts WHERE ts < ?", (time.time() - self.retention,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def export(self, user_id: Optional[str], since: float, until: float, limit: int) -> Iterator[Dict[str, Any]]:
+        query = "SELECT record FROM transcripts WHERE ts >= ? AND ts < ?"
+        params: list = [since, until]
+        if user_id is not None:
+            query += " AND user_id = ?"
+            params.append(user_id)
+        query += " ORDER BY ts LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        for (record,) in rows:
+            yield json.loads(record)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def create_sink(backend: str, path: str, max_file_bytes: int, backups: int, retention_days: float) -> TranscriptSink:
+    """Create the transcript sink selected in the configuration"""
+    if backend == 'jsonl':
+        return JsonlSink(path, max_file_bytes, backups)
+    if backend == 'sqlite':
+        return SQLiteSink(path, retention_days)
+    raise ValueError(f"Unknown transcript backend: {backend}")
+
+class TranscriptRecorder:
+    """
+    Bounded in-memory queue of conversation turns, written to a sink in batches by a
+    background task. Handlers never wait on disk: when the queue is full the overflow
+    policy either drops the oldest or the newest record, or ('block') makes the handler
+    wait up to ``block_timeout`` for space before dropping.
+    """
+
+    def __init__(self, sink: TranscriptSink, max_queue: int, batch_size: int, flush_interval: float,
+                 overflow: str = 'drop_oldest', block_timeout: float = 0.5):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown transcript overflow policy: {overflow}")
+        self.sink = sink
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self._queue: Deque[Dict[str, Any]] = deque()
+        self._task: Optional[asyncio.Task] = None
+        self._batch_ready: Optional[asyncio.Event] = None
+        self._space: Optional[asyncio.Event] = None
+        self.written = 0
+        self.dropped = 0
+
+    async def record(self, user_id: str, request: Dict[str, Any], traces: List[Dict], latency: float,
+                     version: Optional[str], streamed: bool = False):
+        """Queue one turn: the user's request, the traces Voiceflow returned and how long it took"""
+        if len(self._queue) >= self.max_queue:
+            if self.overflow == 'drop_newest':
+                self.dropped += 1
+                return
+            if self.overflow == 'block' and self._space is not None:
+                self._space.clear()
+                try:
+                    await asyncio.wait_for(self._space.wait(), self.block_timeout)
+                except asyncio.TimeoutError:
+                    pass
+            if len(self._queue) >= self.max_queue:
+                self._queue.popleft()
+                self.dropped += 1
+        self._queue.append({
+            'ts': time.time(),
+            'user_id': user_id,
+            'type': request.get('type'),
+            'request': request,
+            'traces': traces,
+            'latency_ms': round(latency * 1000, 1),
+            'version': version,
+            'streamed': streamed
+        })
+        if len(self._queue) >= self.batch_size and self._batch_ready is not None:
+            self._batch_ready.set()
+
+    async def start(self):
+        """Start the background writer"""
+        self._batch_ready = asyncio.Event()
+        self._space = asyncio.Event()
+        self._task = asyncio.create_task(self._write_loop())
+
+    async def stop(self):
+        """Stop the writer, write everything still queued and close the sink"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._queue:
+            await self.flush()
+        await asyncio.to_thread(self.sink.close)
+        if self.dropped:
+            logger.warning(f"{self.dropped} transcript records were dropped because the queue was full")
+
+    async def flush(self):
+        """Write up to one batch of queued records"""
+        count = min(len(self._queue), self.batch_size)
+        if not count:
+            return
+        batch = [self._queue.popleft() for _ in range(count)]
+        if self._space is not None:
+            self._space.set()
+        try:
+            await asyncio.to_thread(self.sink.write_batch, batch)
+            self.written += len(batch)
+        except Exception as e:
+            self.dropped += len(batch)
+            logger.error(f"Failed to write transcripts, {len(batch)} records dropped: {str(e)}")
+
+    async def _write_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+            await self.flush()
+
+    async def export(self, user_id: Optional[str], since: float, until: float, limit: int) -> bytes:
+        """Gzipped JSONL of the matching records, written first so the export includes recent turns"""
+        while self._queue:
+            await self.flush()
+
+        def build() -> bytes:
+            lines = (json.dumps(record, ensure_ascii=False, default=str) + "\n"
+                     for record in self.sink.export(user_id, since, until, limit))
+            return gzip.compress("".join(lines).encode('utf-8'))
+
+        return await asyncio.to_thread(build)
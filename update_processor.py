@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from metrics import UPDATE_QUEUE_WAIT, UPDATE_DURATION, UPDATES_DROPPED, record_stage, start_timeline, end_timeline
+
+logger = logging.getLogger(__name__)
+
+# Upper bound handed to BaseUpdateProcessor. It only has to be large enough that its
+# semaphore never blocks, so that updates reach the per-user lanes in arrival order.
+_MAX_PENDING_UPDATES = 2 ** 31 - 1
+
+class _UserLane:
+    """Ordered execution lane for the updates of a single user"""
+    __slots__ = ('lock', 'pending')
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.pending = 0
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Process updates of different users concurrently while keeping the updates
+    of each user strictly in arrival order.
+    """
+
+    def __init__(self, max_concurrent_updates: int, max_queue_per_user: int,
+                 on_enqueue: Optional[Callable[[object], None]] = None, recent_update_ids: int = 10000,
+                 on_finish: Optional[Callable[[object, float, float], None]] = None,
+                 before_process: Optional[Callable[[object], Awaitable[None]]] = None):
+        super().__init__(_MAX_PENDING_UPDATES)
+        if max_concurrent_updates < 1:
+            raise ValueError("max_concurrent_updates must be a positive integer")
+        if max_queue_per_user < 1:
+            raise ValueError("max_queue_per_user must be a positive integer")
+        self.concurrency_limit = max_concurrent_updates
+        self.max_queue_per_user = max_queue_per_user
+        self._workers = asyncio.Semaphore(max_concurrent_updates)
+        self._lanes: Dict[int, _UserLane] = {}
+        self.dropped_updates = 0
+        # Called with every accepted update as soon as it arrives, before it waits in its lane
+        self.on_enqueue = on_enqueue
+        # Called with the update, its start time and its duration once it has been processed
+        self.on_finish = on_finish
+        # Awaited once the update is first in its lane, before it takes a worker slot
+        self.before_process = before_process
+        # Recently seen update IDs, so that redelivered updates are processed only once
+        self._recent_ids: "OrderedDict[int, None]" = OrderedDict()
+        self._max_recent_ids = recent_update_ids
+
+    @staticmethod
+    def _lane_key(update: object) -> Optional[int]:
+        """Return the key that determines which lane an update belongs to"""
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user:
+            return update.effective_user.id
+        if update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    @property
+    def active_lanes(self) -> int:
+        """Number of users that currently have queued or running updates"""
+        return len(self._lanes)
+
+    def _is_duplicate(self, update: object) -> bool:
+        """Remember the update ID and report whether it was seen before"""
+        if not isinstance(update, Update):
+            return False
+        if update.update_id in self._recent_ids:
+            return True
+        self._recent_ids[update.update_id] = None
+        if len(self._recent_ids) > self._max_recent_ids:
+            self._recent_ids.popitem(last=False)
+        return False
+
+    @staticmethod
+    def _discard(coroutine: Awaitable[Any]):
+        if asyncio.iscoroutine(coroutine):
+            coroutine.close()
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        """Run the update once all earlier updates of the same user have finished"""
+        if self._is_duplicate(update):
+            UPDATES_DROPPED.inc(reason='duplicate')
+            logger.info(f"Dropping duplicate update {update.update_id}")
+            self._discard(coroutine)
+            return
+
+        key = self._lane_key(update)
+        if key is None:
+            received = time.perf_counter()
+            async with self._workers:
+                await self._run(update, coroutine, received)
+            return
+
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = _UserLane()
+        if lane.pending >= self.max_queue_per_user:
+            self.dropped_updates += 1
+            UPDATES_DROPPED.inc(reason='queue_full')
+            logger.warning(f"Dropping update for user {key}: per-user queue is full")
+            self._discard(coroutine)
+            return
+
+        if self.on_enqueue:
+            self.on_enqueue(update)
+        lane.pending += 1
+        received = time.perf_counter()
+        try:
+            async with lane.lock:
+                if self.before_process:
+                    try:
+                        await self.before_process(update)
+                    except BaseException:
+                        self._discard(coroutine)
+                        raise
+                async with self._workers:
+                    await self._run(update, coroutine, received)
+        finally:
+            lane.pending -= 1
+            if lane.pending == 0:
+                # Idle lanes are released right away so memory does not grow with the user count
+                del self._lanes[key]
+
+    async def _run(self, update: object, coroutine: Awaitable[Any], received: float):
+        """Await the update's coroutine, recording queue wait and processing time"""
+        started = time.perf_counter()
+        start_timeline()
+        record_stage('queue_wait', UPDATE_QUEUE_WAIT, received, started - received)
+        try:
+            await coroutine
+        finally:
+            duration = time.perf_counter() - started
+            record_stage('update', UPDATE_DURATION, started, duration)
+            if self.on_finish:
+                try:
+                    self.on_finish(update, received, time.perf_counter() - received)
+                except Exception as e:
+                    logger.error(f"Error in update finish hook: {str(e)}")
+            end_timeline()
+
+    async def initialize(self) -> None:
+        """Nothing to allocate up front; lanes are created on demand"""
+
+    async def shutdown(self) -> None:
+        """Forget all lanes"""
+        self._lanes.clear()
@@ -1,10 +1,15 @@
 import logging
-import requests
+import httpx
 from typing import Optional, Tuple
 from telegram import Update
+from resilience import CircuitOpenError
+from admission import OverloadedError
 
 logger = logging.getLogger(__name__)
 
+# Longest text message forwarded to Voiceflow
+MAX_INPUT_LENGTH = 1000
+
 def get_user_identifier(update: Update) -> Optional[str]:
     """Extract user identifier from update"""
     try:
@@ -16,17 +21,27 @@ def get_user_identifier(update: Update) -> Optional[str]:
 def format_error_message(error: Exception) -> Tuple[str, str]:
     """Format error message for user display and logging"""
     error_type = type(error).__name__
-    if isinstance(error, ConnectionError):
+    if isinstance(error, OverloadedError):
         return (
-            "I'm having trouble connecting to my services. Please try again in a moment.",
-            f"Connection error occurred: {str(error)}"
+            "I'm busy right now. Please retry shortly.",
+            f"Request shed by admission control: {str(error)}"
+        )
+    elif isinstance(error, CircuitOpenError):
+        return (
+            "My services are temporarily unavailable. Please try again in a minute.",
+            f"Request rejected by circuit breaker: {str(error)}"
         )
-    elif isinstance(error, TimeoutError):
+    elif isinstance(error, (TimeoutError, httpx.TimeoutException)):
         return (
             "The request took too long to process. Please try again.",
             f"Timeout error occurred: {str(error)}"
         )
-    elif isinstance(error, requests.exceptions.RequestException):
+    elif isinstance(error, (ConnectionError, httpx.TransportError)):
+        return (
+            "I'm having trouble connecting to my services. Please try again in a moment.",
+            f"Connection error occurred: {str(error)}"
+        )
+    elif isinstance(error, httpx.HTTPError):
         return (
             "There was an issue processing your request. Please try again later.",
             f"API request error: {str(error)}"
@@ -41,6 +56,6 @@ def validate_message(message: str) -> Tuple[bool, str]:
     """Validate user message"""
     if not message:
         return False, "Your message appears to be empty. Please try sending something!"
-    if len(message) > 1000:  # Arbitrary limit
+    if len(message) > MAX_INPUT_LENGTH:
         return False, "Your message is too long. Please try sending a shorter message."
     return True, ""
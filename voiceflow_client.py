@@ -1,10 +1,39 @@
-import requests
+import asyncio
+import httpx
+import json
 import logging
-from typing import Dict, Any, List
-from config import VOICEFLOW_API_KEY, VOICEFLOW_BASE_URL, VOICEFLOW_VERSION
+import time
+from contextlib import aclosing, contextmanager
+from typing import Dict, Any, AsyncIterator, Iterator, List, Optional
+from config import (
+    VOICEFLOW_API_KEY, VOICEFLOW_BASE_URL, VOICEFLOW_VERSION, VOICEFLOW_PROJECT_ID,
+    VOICEFLOW_POOL_SIZE, VOICEFLOW_KEEPALIVE_CONNECTIONS,
+    VOICEFLOW_CONNECT_TIMEOUT, VOICEFLOW_READ_TIMEOUT, VOICEFLOW_HTTP2,
+    VERSION_CACHE_TTL, BREAKER_FAILURE_THRESHOLD, BREAKER_RECOVERY_TIMEOUT, BREAKER_HALF_OPEN_CALLS,
+    ADMISSION_MAX_IN_FLIGHT, ADMISSION_QUEUE_SIZE, ADMISSION_QUEUE_TIMEOUT,
+    VOICEFLOW_ATTEMPT_TIMEOUT, VOICEFLOW_TOTAL_TIMEOUT,
+    VOICEFLOW_RETRY_ATTEMPTS, VOICEFLOW_RETRY_BASE_DELAY, VOICEFLOW_RETRY_MAX_DELAY,
+    VOICEFLOW_HEDGE_LAUNCH, VOICEFLOW_HEDGE_MIN_SAMPLES, VOICEFLOW_HEDGE_BUDGET
+)
+from resilience import (
+    CircuitBreaker, RetryPolicy, HedgeBudget, LatencyWindow, hedged, is_connect_error, is_transient_error
+)
+from admission import AdmissionController, PRIORITY_CALLBACK, PRIORITY_TEXT
+from metrics import VOICEFLOW_REQUEST, annotate, timed
 
 logger = logging.getLogger(__name__)
 
+# Put in a stream buffer after the last trace
+_STREAM_END = object()
+
+def _http2_available() -> bool:
+    """Check whether the optional h2 package needed for HTTP/2 is installed"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
 class VoiceflowClient:
     def __init__(self):
         self.base_url = VOICEFLOW_BASE_URL
@@ -13,59 +42,274 @@ class VoiceflowClient:
             'Content-Type': 'application/json',
             'versionID': VOICEFLOW_VERSION
         }
+        self._client: Optional[httpx.AsyncClient] = None
+        self.breaker = CircuitBreaker(
+            'Voiceflow', BREAKER_FAILURE_THRESHOLD, BREAKER_RECOVERY_TIMEOUT, BREAKER_HALF_OPEN_CALLS
+        )
+        self.admission = AdmissionController(ADMISSION_MAX_IN_FLIGHT, ADMISSION_QUEUE_SIZE, ADMISSION_QUEUE_TIMEOUT)
+        self.retry_policy = RetryPolicy(VOICEFLOW_RETRY_ATTEMPTS, VOICEFLOW_RETRY_BASE_DELAY, VOICEFLOW_RETRY_MAX_DELAY)
+        self.hedge_budget = HedgeBudget(VOICEFLOW_HEDGE_BUDGET)
+        self.launch_latency = LatencyWindow()
+        # Version actually used when 'production' is requested, and until when it is trusted
+        self._resolved_version: Optional[str] = None
+        self._resolved_until = 0.0
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Return the shared keep-alive connection pool, creating it on first use"""
+        if self._client is None or self._client.is_closed:
+            http2 = VOICEFLOW_HTTP2 and _http2_available()
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=self.headers,
+                http2=http2,
+                limits=httpx.Limits(
+                    max_connections=VOICEFLOW_POOL_SIZE,
+                    max_keepalive_connections=VOICEFLOW_KEEPALIVE_CONNECTIONS
+                ),
+                timeout=httpx.Timeout(
+                    VOICEFLOW_READ_TIMEOUT,
+                    connect=VOICEFLOW_CONNECT_TIMEOUT,
+                    pool=VOICEFLOW_CONNECT_TIMEOUT
+                )
+            )
+            logger.info(f"Opened Voiceflow connection pool (size={VOICEFLOW_POOL_SIZE}, http2={http2})")
+        return self._client
+
+    async def close(self):
+        """Close the shared connection pool"""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+            logger.info("Closed Voiceflow connection pool")
+        self._client = None
+
+    @staticmethod
+    def _is_upstream_failure(status_code: int) -> bool:
+        """Statuses that indicate a degraded runtime rather than a bad request"""
+        return status_code >= 500 or status_code == 429
+
+    async def _send(self, method: str, url: str, request_type: str, version: Optional[str] = None,
+                    stream: bool = False, **kwargs) -> httpx.Response:
+        """Send a request through the circuit breaker, timing it by version and request type"""
+        self.breaker.before_call()
+        client = self._get_client()
+        with timed('voiceflow', VOICEFLOW_REQUEST, version=version or VOICEFLOW_VERSION,
+                   request_type=request_type) as labels:
+            try:
+                async with asyncio.timeout(VOICEFLOW_ATTEMPT_TIMEOUT):
+                    response = await client.send(client.build_request(method, url, **kwargs), stream=stream)
+            except httpx.TransportError:
+                self.breaker.record_failure()
+                raise
+            except TimeoutError:
+                self.breaker.record_failure()
+                raise TimeoutError(f"Voiceflow request timed out after {VOICEFLOW_ATTEMPT_TIMEOUT:.0f}s") from None
+            if response.status_code >= 400:
+                labels['outcome'] = f"http_{response.status_code}"
+        if self._is_upstream_failure(response.status_code):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    @staticmethod
+    @contextmanager
+    def _exchange(request: Dict[str, Any], version: Optional[str]) -> Iterator[Dict[str, Any]]:
+        """
+        Attach this Voiceflow exchange to the current update for slow-turn capture: the
+        request up front, then the traces or the error that ended it, and its latency
+        """
+        exchange: Dict[str, Any] = {'request': request, 'version': version}
+        annotate('voiceflow', exchange)
+        started = time.perf_counter()
+        try:
+            yield exchange
+        except BaseException as e:
+            exchange['error'] = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+            raise
+        finally:
+            exchange['latency_ms'] = round((time.perf_counter() - started) * 1000, 1)
+
+    def _resolve_version(self, version: Optional[str]) -> Optional[str]:
+        """Use the cached fallback version while production is known to be unavailable"""
+        if version == 'production' and self._resolved_version and time.monotonic() < self._resolved_until:
+            return self._resolved_version
+        return version
 
-    async def _make_request(self, user_id: str, request: Dict[str, Any], version: str = None) -> List[Dict]:
+    def active_version(self) -> Optional[str]:
+        """Version that requests are currently sent to"""
+        return self._resolve_version(VOICEFLOW_VERSION)
+
+    def _remember_version(self, version: str):
+        self._resolved_version = version
+        self._resolved_until = time.monotonic() + VERSION_CACHE_TTL
+
+    async def _make_request(self, user_id: str, request: Dict[str, Any], version: str = None,
+                            priority: int = PRIORITY_TEXT) -> List[Dict]:
         """
         Make a request to Voiceflow API with version fallback
         """
-        headers = self.headers.copy()
-        if version:
-            headers['versionID'] = version
+        async def attempt():
+            # Interactions change conversation state, so only retry failures that never reached Voiceflow
+            return await self.retry_policy.call(
+                lambda: self._interact_with_fallback(user_id, request, version), is_connect_error
+            )
+
+        async def launch_attempt():
+            started = time.monotonic()
+            traces = await attempt()
+            self.launch_latency.observe(time.monotonic() - started)
+            return traces
+
+        with self._exchange(request, self._resolve_version(version)) as exchange:
+            async with self.admission.slot(priority):
+                try:
+                    async with asyncio.timeout(VOICEFLOW_TOTAL_TIMEOUT):
+                        if request.get('type') == 'launch' and VOICEFLOW_HEDGE_LAUNCH:
+                            # Launching resets the conversation, so a duplicate launch is harmless
+                            exchange['traces'] = await hedged(launch_attempt, self._hedge_delay(), self.hedge_budget)
+                        else:
+                            exchange['traces'] = await attempt()
+                        return exchange['traces']
+                except TimeoutError as e:
+                    if str(e):
+                        raise
+                    raise TimeoutError(f"Voiceflow call exceeded {VOICEFLOW_TOTAL_TIMEOUT:.0f}s") from None
 
+    def _hedge_delay(self) -> Optional[float]:
+        """Hedge launches that run past the observed p95, once enough launches have been seen"""
+        if self.breaker.state != CircuitBreaker.CLOSED:
+            return None
+        if len(self.launch_latency) < VOICEFLOW_HEDGE_MIN_SAMPLES:
+            return None
+        return self.launch_latency.quantile(0.95)
+
+    async def _interact_with_fallback(self, user_id: str, request: Dict[str, Any], version: str = None) -> List[Dict]:
+        """Send the request, retrying with the development version if production is not published"""
+        resolved = self._resolve_version(version)
+        headers = {}
+        if resolved:
+            headers['versionID'] = resolved
+
+        url = f"/state/user/{user_id}/interact"
         try:
-            url = f"{self.base_url}/state/user/{user_id}/interact"
-            response = requests.post(url, headers=headers, json={'request': request})
+            response = await self._send(
+                'POST', url, request.get('type', ''), resolved, headers=headers, json={'request': request}
+            )
+            if resolved == 'production' and response.status_code == 404:
+                # Production version is not published; try development
+                logger.warning("Production version not available, retrying with development")
+                headers['versionID'] = 'development'
+                response = await self._send(
+                    'POST', url, request.get('type', ''), 'development', headers=headers, json={'request': request}
+                )
+                if response.is_success:
+                    # Only a working development version is used for everyone, and only for a while
+                    logger.warning(f"Falling back to the development version for {VERSION_CACHE_TTL:.0f}s")
+                    self._remember_version('development')
             response.raise_for_status()
             return response.json()
-        except requests.exceptions.RequestException as e:
-            if version == 'production' and str(e.response.status_code).startswith('4'):
-                # If production version fails, try development version
-                logger.warning("Production version not available, falling back to development version")
-                headers['versionID'] = 'development'
-                response = requests.post(url, headers=headers, json={'request': request})
-                response.raise_for_status()
-                return response.json()
+        except httpx.HTTPError as e:
             logger.error(f"Error interacting with Voiceflow API: {str(e)}")
             raise
 
-    async def interact(self, user_id: str, request: Dict[str, Any]) -> List[Dict]:
+    async def interact(self, user_id: str, request: Dict[str, Any], priority: int = PRIORITY_TEXT) -> List[Dict]:
         """
         Interact with the Voiceflow API using configured version
         """
-        return await self._make_request(user_id, request, VOICEFLOW_VERSION)
+        return await self._make_request(user_id, request, VOICEFLOW_VERSION, priority)
+
+    async def interact_stream(self, user_id: str, request: Dict[str, Any],
+                              priority: int = PRIORITY_TEXT) -> AsyncIterator[Dict]:
+        """
+        Interact through the streaming API, yielding traces as soon as Voiceflow emits them.
+        A separate task reads the stream into a buffer, so the admission slot and the
+        connection are released when Voiceflow is done, not when rendering is.
+        """
+        buffer: asyncio.Queue = asyncio.Queue()
+        reader = asyncio.create_task(self._read_stream(user_id, request, priority, buffer))
+        try:
+            while (trace := await buffer.get()) is not _STREAM_END:
+                yield trace
+            # Re-raise whatever ended the stream early
+            await reader
+        finally:
+            reader.cancel()
+            await asyncio.gather(reader, return_exceptions=True)
 
-    async def launch_conversation(self, user_id: str) -> List[Dict]:
+    async def _read_stream(self, user_id: str, request: Dict[str, Any], priority: int, buffer: asyncio.Queue):
+        try:
+            with self._exchange(request, self._resolve_version(VOICEFLOW_VERSION)) as exchange:
+                exchange['streamed'] = True
+                exchange['traces'] = received = []
+                async with self.admission.slot(priority):
+                    try:
+                        # The attempt timeout only covers the response headers; this bounds the body too
+                        async with asyncio.timeout(VOICEFLOW_TOTAL_TIMEOUT):
+                            async with aclosing(self._stream_traces(user_id, request)) as traces:
+                                async for trace in traces:
+                                    received.append(trace)
+                                    buffer.put_nowait(trace)
+                    except TimeoutError as e:
+                        if str(e):
+                            raise
+                        raise TimeoutError(f"Voiceflow stream exceeded {VOICEFLOW_TOTAL_TIMEOUT:.0f}s") from None
+        finally:
+            buffer.put_nowait(_STREAM_END)
+
+    async def _stream_traces(self, user_id: str, request: Dict[str, Any]) -> AsyncIterator[Dict]:
+        url = f"/v2/project/{VOICEFLOW_PROJECT_ID}/user/{user_id}/interact/stream"
+        version = self._resolve_version(VOICEFLOW_VERSION)
+        params = {'environment': version, 'completion_events': 'true'}
+        response = await self._send(
+            'POST', url, f"{request.get('type', '')}_stream", version, stream=True,
+            params=params, json={'action': request}, headers={'Accept': 'text/event-stream'}
+        )
+        try:
+            response.raise_for_status()
+            event, data = None, []
+            async for line in response.aiter_lines():
+                if line.startswith('event:'):
+                    event = line[6:].strip()
+                elif line.startswith('data:'):
+                    data.append(line[5:].strip())
+                elif not line:
+                    # A blank line terminates one server-sent event
+                    if event == 'trace' and data:
+                        yield json.loads("\n".join(data))
+                    elif event == 'end':
+                        return
+                    event, data = None, []
+        finally:
+            await response.aclose()
+
+    async def launch_conversation(self, user_id: str, priority: int = PRIORITY_TEXT) -> List[Dict]:
         """Launch a new conversation"""
-        return await self.interact(user_id, {'type': 'launch'})
+        return await self.interact(user_id, {'type': 'launch'}, priority)
 
-    async def send_message(self, user_id: str, message: str) -> List[Dict]:
+    async def send_message(self, user_id: str, message: str, priority: int = PRIORITY_TEXT) -> List[Dict]:
         """Send a text message to Voiceflow"""
         return await self.interact(user_id, {
             'type': 'text',
             'payload': message
-        })
+        }, priority)
 
-    async def handle_button_click(self, user_id: str, button_request: Dict[str, Any]) -> List[Dict]:
+    async def handle_button_click(self, user_id: str, button_request: Dict[str, Any],
+                                  priority: int = PRIORITY_CALLBACK) -> List[Dict]:
         """Handle button click interaction"""
-        return await self.interact(user_id, button_request)
+        return await self.interact(user_id, button_request, priority)
 
-    async def clear_state(self, user_id: str) -> bool:
+    async def clear_state(self, user_id: str, priority: int = PRIORITY_TEXT) -> bool:
         """Clear user conversation state"""
-        try:
-            url = f"{self.base_url}/state/user/{user_id}"
-            response = requests.delete(url, headers=self.headers)
+        async def delete_state():
+            response = await self._send('DELETE', f"/state/user/{user_id}", 'clear_state')
             response.raise_for_status()
+
+        try:
+            async with self.admission.slot(priority):
+                async with asyncio.timeout(VOICEFLOW_TOTAL_TIMEOUT):
+                    # Deleting state is idempotent, so any transient failure can be retried
+                    await self.retry_policy.call(delete_state, is_transient_error)
             return True
-        except requests.exceptions.RequestException as e:
+        except (httpx.HTTPError, TimeoutError) as e:
             logger.error(f"Error clearing conversation state: {str(e)}")
             return False
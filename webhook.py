@@ -0,0 +1,85 @@
+import asyncio
+import hmac
+import json
+import logging
+import signal
+from telegram import Update
+from telegram.ext import Application
+from http_server import HttpRequest, HttpResponse, HttpServer
+from config import WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_SECRET
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+
+class WebhookReceiver:
+    """HTTP endpoints that feed Telegram webhook updates into the application"""
+
+    def __init__(self, application: Application, secret: str):
+        self.application = application
+        self.secret = secret
+        self.webhook_registered = False
+
+    def register(self, server: HttpServer):
+        """Attach the webhook and health endpoints to the server"""
+        server.add_route('POST', WEBHOOK_PATH, self.handle_update)
+        server.add_route('GET', '/healthz', self.health)
+        server.add_route('GET', '/readyz', self.ready)
+
+    async def handle_update(self, request: HttpRequest) -> HttpResponse:
+        """Accept an update and queue it; processing happens in the background"""
+        token = request.headers.get(SECRET_HEADER, '')
+        if not hmac.compare_digest(token.encode(), self.secret.encode()):
+            logger.warning("Rejected webhook call with an invalid secret token")
+            return HttpResponse(403, b'Forbidden')
+        try:
+            update = Update.de_json(json.loads(request.body), self.application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.error(f"Received malformed webhook update: {str(e)}")
+            return HttpResponse(400, b'Bad Request')
+        self.application.update_queue.put_nowait(update)
+        return HttpResponse(200, b'OK')
+
+    async def health(self, request: HttpRequest) -> HttpResponse:
+        """Liveness probe"""
+        return HttpResponse(200, b'OK')
+
+    async def ready(self, request: HttpRequest) -> HttpResponse:
+        """Readiness probe: the application runs and the webhook is registered"""
+        if self.application.running and self.webhook_registered:
+            return HttpResponse(200, b'READY')
+        return HttpResponse(503, b'NOT READY')
+
+async def run_webhook(application: Application):
+    """Serve the application through a Telegram webhook until SIGINT/SIGTERM"""
+    server = HttpServer(WEBHOOK_LISTEN, WEBHOOK_PORT)
+    receiver = WebhookReceiver(application, WEBHOOK_SECRET)
+    receiver.register(server)
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await server.start()
+        await application.start()
+        await application.bot.set_webhook(
+            url=f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES
+        )
+        receiver.webhook_registered = True
+        logger.info("Webhook registered, waiting for updates")
+        await stop_event.wait()
+    finally:
+        receiver.webhook_registered = False
+        await server.stop()
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)